@@ -1,8 +1,6 @@
 import datetime
 from typing import Optional
 
-from dateutil import parser
-
 
 class DateWrapper(datetime.datetime):
     """
@@ -26,6 +24,8 @@ class DateWrapper(datetime.datetime):
             month = m if (m is not None and 0 < m <= 12) else 1
             day = d if (d is not None and 0 < d <= 31) else 1
         elif iso_string is not None:
+            from dateutil import parser  # Only needed when parsing, keeps plugin loading fast
+
             # Replace question marks with first valid field
             iso_string = iso_string.replace("??", "01")
 
@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from .mb_records import ENTITY_TYPES, RecordingRecord, RecordingRelation, ReleaseRecord, WorkRecord
+
+BATCH_SIZE = 10000
+MMAP_SIZE = 2 ** 40  # Map as much of the index as the OS allows
+
+SCHEMA = (
+    'CREATE TABLE recordings (id TEXT PRIMARY KEY, artist_ids TEXT NOT NULL, work_ids TEXT NOT NULL, '
+    'is_cover INTEGER NOT NULL) WITHOUT ROWID',
+    'CREATE TABLE work_recordings (work_id TEXT NOT NULL, recording_id TEXT NOT NULL, begin TEXT, '
+    'attributes TEXT NOT NULL, PRIMARY KEY (work_id, recording_id)) WITHOUT ROWID',
+    'CREATE TABLE recording_releases (recording_id TEXT NOT NULL, release_id TEXT NOT NULL, date TEXT, status TEXT, '
+    'PRIMARY KEY (recording_id, release_id)) WITHOUT ROWID',
+)
+
+
+def _dump_entity_type(name: str) -> Optional[str]:
+    """Entity type of a dump file or tar member, e.g. mbdump/recording"""
+    base = os.path.basename(name).split('.')[0]
+    return base if base in ENTITY_TYPES else None
+
+
+def iterate_dump(path: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """
+    Yield the entity type and a line stream for each entity file in a dump.
+    Accepts the dump archives as distributed, e.g. recording.tar.xz, or already extracted files, e.g. mbdump/recording.
+    """
+    import tarfile  # Slow to import, and only needed when building the index
+
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for member in archive:
+                entity_type = _dump_entity_type(member.name)
+                if member.isfile() and member.name.startswith('mbdump/') and entity_type:
+                    stream = archive.extractfile(member)
+                    if stream is not None:
+                        yield entity_type, stream
+    else:
+        entity_type = _dump_entity_type(path)
+        if entity_type is None:
+            raise ValueError(f'Unknown dump file {path}, expected one of: {", ".join(ENTITY_TYPES)}')
+        with open(path, 'rb') as stream:
+            yield entity_type, stream
+
+
+class DumpIndex:
+    """
+    Local index of the MusicBrainz data needed to find oldest dates, built from the JSON data dumps:
+    recording to artists, works and cover attribute; work to recordings with begin dates and attributes;
+    and recording to release dates and statuses. Stored as an SQLite database, memory-mapped when read.
+    """
+
+    def __init__(self, path: str) -> None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No oldestdate index at {path}, build it with beet oldestdate-index')
+        # Import stages run in worker threads, so the connection is shared behind a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self._connection.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+
+    def get_recording(self, recording_id: str) -> Optional[RecordingRecord]:
+        """Get a recording with its releases, None if it is not in the dump"""
+        with self._lock:
+            row = self._connection.execute('SELECT artist_ids, work_ids, is_cover FROM recordings WHERE id = ?',
+                                           (recording_id,)).fetchone()
+            if row is None:
+                return None
+            releases = self._connection.execute(
+                'SELECT date, status, release_id FROM recording_releases WHERE recording_id = ?',
+                (recording_id,)).fetchall()
+        return RecordingRecord(recording_id, tuple(json.loads(row[0])), tuple(json.loads(row[1])), bool(row[2]),
+                               tuple(ReleaseRecord(*release) for release in releases))
+
+    def get_work(self, work_id: str) -> Optional[WorkRecord]:
+        """Get a work with its recordings, None if no recordings of it are in the dump"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT recording_id, begin, attributes FROM work_recordings WHERE work_id = ?', (work_id,)).fetchall()
+        if not rows:
+            return None
+        return WorkRecord(work_id, tuple(RecordingRelation(recording_id, begin, tuple(json.loads(attributes)))
+                                         for recording_id, begin, attributes in rows))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @classmethod
+    def build(cls, path: str, dumps: Iterable[str],
+              progress: Optional[Callable[[str, int], None]] = None) -> Dict[str, int]:
+        """
+        Build an index from dump files, replacing any existing index only once complete.
+        :param path: Where to store the index
+        :param dumps: Paths of the recording, work and release dumps
+        :param progress: Called with the entity type and amount of entities read so far, every batch
+        :return: The amount of entities read, by type
+        """
+        temp_path = path + '.tmp'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        counts = {entity_type: 0 for entity_type in ENTITY_TYPES}
+        connection = sqlite3.connect(temp_path)
+        try:
+            # Nothing to lose if the build is interrupted, so skip journaling
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('PRAGMA synchronous=OFF')
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+            for dump in dumps:
+                for entity_type, stream in iterate_dump(dump):
+                    read_before = counts[entity_type]  # A type can be split across several files
+                    for count in _index_entities(connection, entity_type, stream):
+                        counts[entity_type] = read_before + count
+                        if progress is not None:
+                            progress(entity_type, counts[entity_type])
+            connection.commit()
+        finally:
+            connection.close()
+
+        os.replace(temp_path, path)
+        return counts
+
+
+def _index_entities(connection: sqlite3.Connection, entity_type: str, stream: IO[bytes]) -> Iterator[int]:
+    """Insert the entities of a dump file in batches, yielding the amount read after each batch"""
+    recordings: List[Tuple[Any, ...]] = []
+    work_recordings: List[Tuple[Any, ...]] = []
+    recording_releases: List[Tuple[Any, ...]] = []
+    count = 0
+
+    def flush() -> None:
+        connection.executemany('INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?)', recordings)
+        connection.executemany('INSERT OR REPLACE INTO work_recordings VALUES (?, ?, ?, ?)', work_recordings)
+        connection.executemany('INSERT OR IGNORE INTO recording_releases VALUES (?, ?, ?, ?)', recording_releases)
+        recordings.clear()
+        work_recordings.clear()
+        recording_releases.clear()
+
+    for line in stream:
+        if not line.strip():
+            continue
+        entity = json.loads(line)
+        count += 1
+
+        if entity_type == 'recording':
+            record = RecordingRecord.from_ws_json(entity)
+            recordings.append((record.id, json.dumps(record.artist_ids), json.dumps(record.work_ids),
+                               int(record.is_cover)))
+            # The work relations of a recording are the recording relations of the work
+            for relation in entity.get('relations', []):
+                if relation.get('target-type') == 'work' and 'id' in (relation.get('work') or {}):
+                    work_recordings.append((relation['work']['id'], record.id, relation.get('begin'),
+                                            json.dumps(relation.get('attributes') or [])))
+        elif entity_type == 'work':
+            work = WorkRecord.from_ws_json(entity)
+            work_recordings.extend((work.id, relation.id, relation.begin, json.dumps(relation.attributes))
+                                   for relation in work.recordings)
+        else:
+            date = entity.get('date') or None
+            for medium in entity.get('media') or []:
+                for track in medium.get('tracks') or []:
+                    recording = track.get('recording') or {}
+                    if 'id' in recording:
+                        recording_releases.append((recording['id'], entity['id'], date, entity.get('status')))
+
+        if count % BATCH_SIZE == 0:
+            flush()
+            yield count
+
+    flush()
+    yield count
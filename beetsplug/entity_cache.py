@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Set, Tuple
+
+
+class EntityCache:
+    """
+    Persistent cache of JSON-serialisable MusicBrainz data, stored in SQLite.
+    Entries are keyed by kind (e.g. recording, work) and id, and expire after a TTL.
+    Negative entries, such as lookups that found nothing, have their own TTL so they can be retried sooner.
+    Links between entities, e.g. the recordings on a release, are kept without expiring, so that changes can be
+    traced to the results that depend on them after the entities themselves have expired.
+    """
+
+    def __init__(self, path: str, ttl: float, negative_ttl: float,
+                 clock: Callable[[], float] = time.time) -> None:
+        """
+        :param path: Path to the database file, or :memory: for a cache that only lasts for this run
+        :param ttl: Seconds after which an entry expires
+        :param negative_ttl: Seconds after which a negative entry expires
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        # Import stages run in worker threads, so the connection is shared behind a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'kind TEXT NOT NULL, id TEXT NOT NULL, value TEXT NOT NULL, negative INTEGER NOT NULL, '
+                'expires REAL NOT NULL, PRIMARY KEY (kind, id)) WITHOUT ROWID')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS links ('
+                'kind TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, '
+                'PRIMARY KEY (kind, source, target)) WITHOUT ROWID')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS links_by_target ON links (kind, target, source)')
+            self._connection.execute('DELETE FROM entries WHERE expires <= ?', (self._clock(),))
+
+    def get(self, kind: str, entity_id: str) -> Any:
+        """Return the cached value, raising KeyError if it is missing or has expired"""
+        with self._lock:
+            row = self._connection.execute('SELECT value, expires FROM entries WHERE kind = ? AND id = ?',
+                                           (kind, entity_id)).fetchone()
+        if row is None or row[1] <= self._clock():
+            raise KeyError((kind, entity_id))
+        return json.loads(row[0])
+
+    def put(self, kind: str, entity_id: str, value: Any, negative: bool = False) -> None:
+        """Store a value, replacing any previous entry"""
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                     (kind, entity_id, json.dumps(value), int(negative), self._clock() + ttl))
+
+    def delete(self, kind: str, entity_ids: Iterable[str]) -> None:
+        """Remove entries, ignoring ids that are not cached"""
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM entries WHERE kind = ? AND id = ?',
+                                         ((kind, entity_id) for entity_id in entity_ids))
+
+    def link(self, kind: str, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Record links from source to target ids, e.g. from a release to the recordings on it"""
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO links VALUES (?, ?, ?)',
+                                         ((kind, source, target) for source, target in pairs))
+
+    def linked_from(self, kind: str, sources: Iterable[str]) -> Set[str]:
+        """Return the ids linked from any of the sources"""
+        return self._select_links('SELECT target FROM links WHERE kind = ? AND source IN ({0})', kind, sources)
+
+    def linked_to(self, kind: str, targets: Iterable[str]) -> Set[str]:
+        """Return the ids linking to any of the targets"""
+        return self._select_links('SELECT source FROM links WHERE kind = ? AND target IN ({0})', kind, targets)
+
+    def _select_links(self, statement: str, kind: str, entity_ids: Iterable[str]) -> Set[str]:
+        entity_ids = list(entity_ids)
+        found: Set[str] = set()
+        with self._lock:
+            # Chunked to stay below the limit on query parameters
+            for start in range(0, len(entity_ids), 500):
+                chunk = entity_ids[start:start + 500]
+                rows: List[Tuple[str]] = self._connection.execute(
+                    statement.format(', '.join('?' * len(chunk))), [kind] + chunk).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
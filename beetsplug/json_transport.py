@@ -0,0 +1,122 @@
+import http.client
+import json
+import threading
+import urllib.error
+import urllib.parse
+from typing import Any, Dict, List, Tuple
+
+from .mirror_pool import Mirror
+
+# Every field the plugin reads from recordings and works, at any depth. Anything else is dropped while parsing
+USED_FIELDS = frozenset(('id', 'artist-credit', 'artist', 'releases', 'date', 'status', 'relations', 'target-type',
+                         'attributes', 'work', 'recording', 'begin'))
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_POOL_SIZE = 4
+
+
+def _keep_used_fields(pairs: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    """Build JSON objects with only the fields the plugin uses, so unused subtrees are freed as soon as parsed"""
+    return {key: value for key, value in pairs if key in USED_FIELDS}
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections to each host, so that requests don't pay for a new TCP and TLS handshake.
+    """
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT) -> None:
+        """
+        :param size: Maximum amount of idle connections kept per host
+        :param timeout: Timeout for connecting and for each read, in seconds
+        """
+        self.size = size
+        self.timeout = timeout
+        self.opened = 0  # Connections opened so far
+        self.reused = 0  # Requests made on an already open connection
+        self._idle: Dict[Tuple[bool, str], List[http.client.HTTPConnection]] = {}
+        # Import stages run in worker threads
+        self._lock = threading.Lock()
+
+    def acquire(self, mirror: Mirror) -> Tuple[http.client.HTTPConnection, bool]:
+        """Get an idle connection to the mirror, or a new one. Also returns whether the connection is reused"""
+        with self._lock:
+            idle = self._idle.get((mirror.https, mirror.host))
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.opened += 1
+
+        connection_class = http.client.HTTPSConnection if mirror.https else http.client.HTTPConnection
+        return connection_class(mirror.host, timeout=self.timeout), False
+
+    def release(self, mirror: Mirror, connection: http.client.HTTPConnection) -> None:
+        """Return a connection whose response has been fully read, closing it if the pool is full"""
+        with self._lock:
+            idle = self._idle.setdefault((mirror.https, mirror.host), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+class JsonTransport:
+    """
+    Fetches entities from the MusicBrainz web service in its JSON format, which is much cheaper to parse than the XML
+    musicbrainzngs requests, over pooled keep-alive connections. Errors are raised as the equivalent musicbrainzngs
+    exceptions.
+    """
+
+    def __init__(self, user_agent: str, timeout: float = DEFAULT_TIMEOUT, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        self.user_agent = user_agent
+        self.pool = ConnectionPool(pool_size, timeout)
+
+    @staticmethod
+    def path(entity: str, entity_id: str, includes: List[str]) -> str:
+        return '/ws/2/{0}/{1}?{2}'.format(entity, urllib.parse.quote(entity_id),
+                                          urllib.parse.urlencode({'inc': ' '.join(includes), 'fmt': 'json'}))
+
+    def get(self, mirror: Mirror, entity: str, entity_id: str, includes: List[str]) -> Dict[str, Any]:
+        """Fetch an entity from the given mirror, keeping only the fields the plugin uses"""
+        import musicbrainzngs
+
+        path = self.path(entity, entity_id, includes)
+        headers = {'User-Agent': self.user_agent, 'Accept': 'application/json'}
+
+        while True:
+            connection, reused = self.pool.acquire(mirror)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if reused:  # The server may have closed an idle connection, try again on a fresh one
+                    continue
+                raise musicbrainzngs.NetworkError(cause=e)
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(mirror, connection)
+
+        if response.status >= 400:
+            error = urllib.error.HTTPError(path, response.status, response.reason, response.headers, None)
+            # Server errors, including rate limiting, are worth retrying on another mirror
+            if response.status >= 500:
+                raise musicbrainzngs.NetworkError(cause=error)
+            raise musicbrainzngs.ResponseError(cause=error)
+
+        try:
+            result: Dict[str, Any] = json.loads(body, object_pairs_hook=_keep_used_fields)
+        except ValueError as e:
+            raise musicbrainzngs.ResponseError(cause=e)
+        return result
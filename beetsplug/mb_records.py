@@ -0,0 +1,148 @@
+"""
+Compact records holding only the MusicBrainz fields the plugin uses.
+Responses are projected into these as soon as they are fetched, so the full responses never stay in memory.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# Entity types the plugin reads, as named in the data dumps and in change lists
+ENTITY_TYPES = ('recording', 'work', 'release')
+
+
+class ReleaseRecord:
+    """Date, status and id of a release a recording appears on"""
+    __slots__ = ('date', 'status', 'id')
+
+    def __init__(self, date: Optional[str], status: Optional[str], release_id: Optional[str] = None) -> None:
+        self.date = date
+        self.status = status
+        self.id = release_id
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ReleaseRecord):
+            return NotImplemented
+        return (self.date, self.status, self.id) == (other.date, other.status, other.id)
+
+    def __repr__(self) -> str:
+        return f"ReleaseRecord({self.date!r}, {self.status!r}, {self.id!r})"
+
+
+class RecordingRecord:
+    """A recording, with its artists, works and releases"""
+    __slots__ = ('id', 'artist_ids', 'work_ids', 'is_cover', 'releases')
+
+    def __init__(self, recording_id: str, artist_ids: Tuple[str, ...] = (), work_ids: Tuple[str, ...] = (),
+                 is_cover: bool = False, releases: Tuple[ReleaseRecord, ...] = ()) -> None:
+        """
+        :param recording_id: The MusicBrainz id of the recording
+        :param artist_ids: Ids of the credited artists
+        :param work_ids: Ids of the works the recording is related to
+        :param is_cover: Whether any of the work relations is marked as a cover
+        :param releases: The releases the recording appears on
+        """
+        self.id = recording_id
+        self.artist_ids = artist_ids
+        self.work_ids = work_ids
+        self.is_cover = is_cover
+        self.releases = releases
+
+    @classmethod
+    def from_mb(cls, recording: Dict[str, Any]) -> 'RecordingRecord':
+        """Project a recording as returned by musicbrainzngs"""
+        artist_ids = tuple(credit['artist']['id'] for credit in recording.get('artist-credit', [])
+                           if isinstance(credit, dict) and 'id' in credit.get('artist', {}))
+        work_relations = recording.get('work-relation-list', [])
+        work_ids = tuple(relation['work']['id'] for relation in work_relations
+                         if 'id' in relation.get('work', {}))
+        is_cover = any('cover' in relation.get('attribute-list', []) for relation in work_relations)
+        releases = tuple(ReleaseRecord(release.get('date'), release.get('status'), release.get('id'))
+                         for release in recording.get('release-list', []))
+        return cls(recording.get('id', ''), artist_ids, work_ids, is_cover, releases)
+
+    @classmethod
+    def from_ws_json(cls, recording: Dict[str, Any]) -> 'RecordingRecord':
+        """Project a recording in the web service's JSON format"""
+        artist_ids = tuple(credit['artist']['id'] for credit in recording.get('artist-credit', [])
+                           if 'id' in (credit.get('artist') or {}))
+        work_relations = [relation for relation in recording.get('relations', [])
+                          if relation.get('target-type') == 'work' and 'id' in (relation.get('work') or {})]
+        work_ids = tuple(relation['work']['id'] for relation in work_relations)
+        is_cover = any('cover' in (relation.get('attributes') or []) for relation in work_relations)
+        releases = tuple(ReleaseRecord(release.get('date') or None, release.get('status'), release.get('id'))
+                         for release in recording.get('releases', []))
+        return cls(recording.get('id', ''), artist_ids, work_ids, is_cover, releases)
+
+    def to_json(self) -> List[Any]:
+        return [self.id, list(self.artist_ids), list(self.work_ids), self.is_cover,
+                [[release.date, release.status, release.id] for release in self.releases]]
+
+    @classmethod
+    def from_json(cls, data: Optional[List[Any]]) -> Optional['RecordingRecord']:
+        """Load a record stored with to_json. None means the recording does not exist"""
+        if data is None:
+            return None
+        recording_id, artist_ids, work_ids, is_cover, releases = data
+        # Releases cached before ids were kept only have a date and status
+        return cls(recording_id, tuple(artist_ids), tuple(work_ids), is_cover,
+                   tuple(ReleaseRecord(*release) for release in releases))
+
+    def __repr__(self) -> str:
+        return f"RecordingRecord({self.id!r})"
+
+
+class RecordingRelation:
+    """A recording related to a work, with the begin date and attributes of the relation"""
+    __slots__ = ('id', 'begin', 'attributes')
+
+    def __init__(self, recording_id: str, begin: Optional[str] = None, attributes: Tuple[str, ...] = ()) -> None:
+        self.id = recording_id
+        self.begin = begin
+        self.attributes = attributes
+
+    @classmethod
+    def from_mb(cls, relation: Dict[str, Any]) -> 'RecordingRelation':
+        """Project a recording relation of a work as returned by musicbrainzngs"""
+        return cls(relation.get('recording', {}).get('id'), relation.get('begin'),
+                   tuple(relation.get('attribute-list', [])))
+
+    def __repr__(self) -> str:
+        return f"RecordingRelation({self.id!r})"
+
+
+class WorkRecord:
+    """A work, with its related recordings"""
+    __slots__ = ('id', 'recordings')
+
+    def __init__(self, work_id: str, recordings: Tuple[RecordingRelation, ...] = ()) -> None:
+        self.id = work_id
+        self.recordings = recordings
+
+    @classmethod
+    def from_mb(cls, work: Dict[str, Any]) -> 'WorkRecord':
+        """Project a work as returned by musicbrainzngs, including its recording relations"""
+        return cls(work.get('id', ''), tuple(RecordingRelation.from_mb(relation)
+                                             for relation in work.get('recording-relation-list', [])
+                                             if 'id' in relation.get('recording', {})))
+
+    @classmethod
+    def from_ws_json(cls, work: Dict[str, Any]) -> 'WorkRecord':
+        """Project a work in the web service's JSON format, including its recording relations"""
+        return cls(work.get('id', ''), tuple(
+            RecordingRelation(relation['recording']['id'], relation.get('begin'),
+                              tuple(relation.get('attributes') or []))
+            for relation in work.get('relations', [])
+            if relation.get('target-type') == 'recording' and 'id' in (relation.get('recording') or {})))
+
+    def to_json(self) -> List[Any]:
+        return [self.id, [[relation.id, relation.begin, list(relation.attributes)] for relation in self.recordings]]
+
+    @classmethod
+    def from_json(cls, data: Optional[List[Any]]) -> Optional['WorkRecord']:
+        """Load a record stored with to_json. None means the work does not exist"""
+        if data is None:
+            return None
+        work_id, recordings = data
+        return cls(work_id, tuple(RecordingRelation(recording_id, begin, tuple(attributes))
+                                  for recording_id, begin, attributes in recordings))
+
+    def __repr__(self) -> str:
+        return f"WorkRecord({self.id!r})"
@@ -0,0 +1,88 @@
+import threading
+import time
+from typing import Callable, List
+
+
+class Mirror:
+    """
+    A MusicBrainz web service host, with its own rate limit and health state.
+    """
+
+    def __init__(self, host: str, https: bool = False, rate_limit: int = 1, interval: float = 1.0) -> None:
+        """
+        :param host: The hostname, optionally including a port, e.g. localhost:5000
+        :param https: Whether to connect using HTTPS
+        :param rate_limit: Maximum amount of requests per interval
+        :param interval: Length of the rate limit interval, in seconds
+        """
+        if rate_limit < 1 or interval < 0:
+            raise ValueError(f"Invalid rate limit for mirror {host}")
+        self.host = host
+        self.https = https
+        self.delay = interval / rate_limit  # Minimum time between two requests
+        self.next_request = 0.0  # Earliest time at which the next request may be made
+        self.failures = 0  # Consecutive failures
+        self.down_until = 0.0  # Time until which the mirror is considered unhealthy
+
+    def __repr__(self) -> str:
+        return f"Mirror({self.host!r})"
+
+
+class MirrorPool:
+    """
+    Distributes requests across several mirrors, respecting each mirror's rate limit.
+    Mirrors that fail are taken out of rotation for a cooldown period that grows with each consecutive failure.
+    """
+
+    def __init__(self, mirrors: List[Mirror], cooldown: float = 30.0, max_cooldown: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        if not mirrors:
+            raise ValueError("At least one mirror must be specified")
+        self.mirrors = mirrors
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._sleep = sleep
+        # Import stages run in worker threads, which share the mirrors and their rate limits
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.mirrors)
+
+    def is_healthy(self, mirror: Mirror) -> bool:
+        return mirror.down_until <= self._clock()
+
+    def has_healthy(self) -> bool:
+        return any(self.is_healthy(mirror) for mirror in self.mirrors)
+
+    def acquire(self) -> Mirror:
+        """
+        Choose the healthy mirror that can accept a request the soonest, waiting for its rate limit if needed.
+        If every mirror is unhealthy, the one that recovers first is used rather than stalling the run.
+        """
+        with self._lock:
+            now = self._clock()
+            healthy = [mirror for mirror in self.mirrors if mirror.down_until <= now]
+            if healthy:
+                mirror = min(healthy, key=lambda m: m.next_request)
+            else:
+                mirror = min(self.mirrors, key=lambda m: m.down_until)
+
+            # Reserve the slot before waiting for it, so that other threads queue up behind it
+            start = max(now, mirror.next_request)
+            mirror.next_request = start + mirror.delay
+
+        if start > now:
+            self._sleep(start - now)
+        return mirror
+
+    def report_success(self, mirror: Mirror) -> None:
+        with self._lock:
+            mirror.failures = 0
+            mirror.down_until = 0.0
+
+    def report_failure(self, mirror: Mirror) -> None:
+        with self._lock:
+            mirror.failures += 1
+            cooldown = min(self.cooldown * 2 ** (mirror.failures - 1), self.max_cooldown)
+            mirror.down_until = self._clock() + cooldown
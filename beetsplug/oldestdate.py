@@ -1,31 +1,66 @@
+import contextlib
+import json
+import math
+import optparse
+import os
+import sys
+import threading
 import time
-from typing import Optional, Any, List, Dict, Callable, TypeVar
+import zlib
+from typing import Optional, Any, List, Dict, Callable, TypeVar, Iterator, Iterable, Tuple, Sequence, Set, TYPE_CHECKING
 import mediafile
-import musicbrainzngs
-from beets import ui, config
+from beets import ui, config, util
 from beets.autotag import hooks, TrackInfo
+from beets.dbcore.query import AndQuery, MatchQuery, NumericQuery, OrQuery, Query
 from beets.importer import action, ImportTask, ImportSession
-from beets.library import Item, Library
+from beets.library import FileOperationError, Item, Library, parse_query_parts
 from beets.plugins import BeetsPlugin
-from musicbrainzngs import NetworkError
 
 from .date_wrapper import DateWrapper
+from .entity_cache import EntityCache
+from .json_transport import JsonTransport
+from .mb_records import ENTITY_TYPES, RecordingRecord, RecordingRelation, ReleaseRecord, WorkRecord
+from .mirror_pool import Mirror, MirrorPool
 
-musicbrainzngs.set_useragent(
+if TYPE_CHECKING:  # Only imported when offline mode or the index command is used
+    from .dump_index import DumpIndex
+
+# musicbrainzngs is only imported and configured once a date is actually resolved, see _get_mirror_pool
+USER_AGENT = (
     "Beets oldestdate plugin",
     '1.1.4',  # Also change in pyproject.toml
     "https://github.com/kernitus/beets-oldestdate"
 )
 
 # Type alias
-Recording = Dict[str, Any]
-Work = Dict[str, Any]
+Result = Dict[str, Any]
+
 
+class ItemBudget:
+    """Requests and time spent resolving a single item, and what was settled for once they ran out"""
+    __slots__ = ('requests', 'start', 'approximate', 'local_recordings', 'approach')
+
+    def __init__(self) -> None:
+        self.requests = 0  # Network requests made while resolving the item
+        self.start = time.monotonic()  # When resolution of the item started
+        self.approximate = False  # Whether the budget ran out
+        self.local_recordings: Optional[Dict[str, RecordingRecord]] = None  # Releases in the library, for the work
+        self.approach: Optional[str] = None  # Approach used to look for dates, with auto resolved to the one chosen
 
 
 class OldestDatePlugin(BeetsPlugin):  # type: ignore
     _importing: bool = False
-    _recordings_cache: Dict[str, Recording] = dict()
+    _recordings_cache: Dict[str, Optional[RecordingRecord]] = dict()  # None if the recording does not exist
+    # Import stages resolve items in separate threads, so each thread has its own ItemBudget, see _budget
+    _item_state = threading.local()
+    _mirror_pool: Optional[MirrorPool] = None  # Created on first network request
+    _entity_cache: Optional[EntityCache] = None  # Opened on first lookup
+    _json_transport: Optional[JsonTransport] = None  # Created on first request, if enabled
+    _dump_index: Optional['DumpIndex'] = None  # Opened on first lookup, in offline mode
+    _lib: Optional[Library] = None  # Library being processed, for local release lookups
+    _total_requests: int = 0  # Network requests made during this run, including retries
+    _cached_this_run: Set[Tuple[str, str]] = set()  # Kind and id of cache entries written during this run
+    _hostname_lock = threading.Lock()  # musicbrainzngs' hostname is process-wide, and import stages run in threads
 
     def __init__(self) -> None:
         super(OldestDatePlugin, self).__init__()
@@ -40,12 +75,30 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
             'overwrite_month': True,  # If overwriting date, also overwrite month field
             'overwrite_day': True,  # If overwriting date and month, also overwrite day
             'filter_recordings': True,  # Skip recordings with attributes before fetching them
-            'approach': 'releases',  # recordings, releases, hybrid, both
+            'approach': 'releases',  # recordings, releases, hybrid, both, auto
             'release_types': None,  # Filter by release type, e.g. ['Official']
             'use_file_date': False,  # Also use file's embedded date when looking for oldest date
-            'max_network_retries': 3  # Maximum amount of times a given network call will be retried
+            'max_network_retries': 3,  # Maximum amount of times a given network call will be retried
+            'max_requests_per_item': None,  # Stop fetching releases for an item after this many requests
+            'max_seconds_per_item': None,  # Stop fetching releases for an item after this many seconds
+            'mirrors': [],  # MusicBrainz hosts to distribute requests across. Defaults to the musicbrainz host
+            'mirror_cooldown': 30,  # Seconds a failing mirror is taken out of rotation for, doubling on each failure
+            'transport': 'musicbrainzngs',  # musicbrainzngs or json, which is lighter to parse
+            'http_timeout': 30,  # Seconds to wait when connecting or reading, with the json transport
+            'http_pool_size': 4,  # Idle keep-alive connections kept per mirror, with the json transport
+            'cache': True,  # Keep fetched recordings and works between runs
+            'cache_file': None,  # Defaults to oldestdate_cache.db in the beets configuration directory
+            'cache_ttl': 7 * 24 * 60 * 60,  # Seconds after which cached data is fetched again
+            'negative_cache_ttl': 24 * 60 * 60,  # Same, for dead ends such as recordings without a work
+            'offline': False,  # Read MusicBrainz data from the local index built by oldestdate-index
+            'index_file': None,  # Defaults to oldestdate_index.db in the beets configuration directory
+            'local_releases': False,  # Use release dates of albums in the library for recordings not fetched
+            'watch_interval': 60,  # Seconds between checks for new items, with --watch
+            'watch_max_wait': 600,  # Seconds to wait for new items' files to be moved into the library, with --watch
         })
 
+        self._check_config()
+
         if self.config['auto']:
             if self.config['ignore_track_id']:
                 self.register_listener('import_task_created', self._import_task_created)
@@ -56,10 +109,7 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
                 # Add heavy weight for missing work_id from a track
                 config['match']['distance_weights'].add({'work_id': 4})
 
-        # Get global MusicBrainz host setting
-        musicbrainzngs.set_hostname(config['musicbrainz']['host'].get())
-        musicbrainzngs.set_rate_limit(1, config['musicbrainz']['ratelimit'].get())
-
+        # Needed at load time so that any command writing tags knows about the recording fields
         for recording_field in (
                 'recording_year',
                 'recording_month',
@@ -71,18 +121,51 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
                 mediafile.StorageStyle(recording_field))
             self.add_media_field(recording_field, field)
 
+    def _check_config(self) -> None:
+        """Warn about settings that do nothing on their own"""
+        if self.config['local_releases'] and self.config['max_requests_per_item'].get() is None \
+                and self.config['max_seconds_per_item'].get() is None:
+            self._log.warning('local_releases has no effect without max_requests_per_item or max_seconds_per_item')
+
     def commands(self) -> List[ui.Subcommand]:
         recording_date_command = ui.Subcommand(
             'oldestdate',
             help="Retrieve the date of the oldest known recording or release of a track.",
             aliases=['olddate'])
+        recording_date_command.parser.add_option(
+            '--export', dest='export', metavar='FILE',
+            help="compute dates and write them to FILE as JSON lines, without modifying the library")
+        recording_date_command.parser.add_option(
+            '--apply', dest='apply', metavar='FILE',
+            help="apply dates previously computed with --export from FILE")
+        recording_date_command.parser.add_option(
+            '--shard', dest='shard', metavar='I/N',
+            help="only process shard I of N (1-based), partitioned by work id or recording id")
+        recording_date_command.parser.add_option(
+            '--prefetch', dest='prefetch', action='store_true', default=False,
+            help="download the recordings and works needed into the cache, without resolving dates")
+        recording_date_command.parser.add_option(
+            '--watch', dest='watch', action='store_true', default=False,
+            help="keep running, resolving items as they are added to the library")
         recording_date_command.func = self._command_func
-        return [recording_date_command]
+
+        index_command = ui.Subcommand(
+            'oldestdate-index',
+            help="Build the local index used in offline mode from MusicBrainz JSON data dumps.")
+        index_command.parser.usage += ' DUMP...'
+        index_command.func = self._index_command_func
+
+        invalidate_command = ui.Subcommand(
+            'oldestdate-invalidate',
+            help="Invalidate cached data and dates affected by changed MusicBrainz entities.")
+        invalidate_command.parser.usage += ' FILE...'
+        invalidate_command.func = self._invalidate_command_func
+        return [recording_date_command, index_command, invalidate_command]
 
     def _import_trackinfo(self, info: TrackInfo) -> None:
         """Fetch the recording associated with each candidate"""
         if 'track_id' in info:
-            self._fetch_recording(info.track_id)
+            self._get_recording(info.track_id)
 
     def track_distance(self, _: Item, info: TrackInfo) -> hooks.Distance:
         dist = hooks.Distance()
@@ -108,6 +191,7 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
                       + "+artist%3A%22" + match.artist.replace(' ', '+') \
                       + "%22&type=recording&limit=100&method=advanced"
 
+        self._reset_budget()
         while not self._has_work_id(recording_id):
             recording_date = self._get_oldest_date(recording_id,
                                                    DateWrapper(task.item.year, task.item.month, task.item.day))
@@ -120,6 +204,7 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
             sel = ui.input_options(('Use this recording', 'Try again', 'Skip track'))
 
             if sel == "t":  # Fetch data again
+                self._reset_budget()
                 self._fetch_recording(recording_id)
             elif sel == "u":
                 return
@@ -127,110 +212,630 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
                 task.choice_flag = action.SKIP
                 return
 
+    def _create_mirror_pool(self) -> MirrorPool:
+        """Create the pool of MusicBrainz hosts, using the global MusicBrainz settings as defaults"""
+        mb_config = config['musicbrainz']
+        https: bool = mb_config['https'].get(bool)
+        rate_limit: int = mb_config['ratelimit'].get(int)
+        interval: float = mb_config['ratelimit_interval'].as_number()
+
+        mirrors = []
+        for entry in self.config['mirrors'].get(list) or []:
+            if isinstance(entry, str):
+                entry = {'host': entry}
+            try:
+                mirrors.append(Mirror(str(entry['host']), bool(entry.get('https', https)),
+                                      int(entry.get('ratelimit', rate_limit)),
+                                      float(entry.get('ratelimit_interval', interval))))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise ui.UserError(f'Invalid oldestdate mirror configuration: {entry}')
+
+        if not mirrors:
+            mirrors.append(Mirror(mb_config['host'].get(str), https, rate_limit, interval))
+
+        return MirrorPool(mirrors, cooldown=self.config['mirror_cooldown'].as_number())
+
+    def _get_mirror_pool(self) -> MirrorPool:
+        """Configure musicbrainzngs and create the mirror pool on first use"""
+        if self._mirror_pool is None:
+            import musicbrainzngs
+
+            pool = self._create_mirror_pool()
+            musicbrainzngs.set_useragent(*USER_AGENT)
+            musicbrainzngs.set_hostname(pool.mirrors[0].host, pool.mirrors[0].https)
+            # Per-host rate limits are enforced by the pool, musicbrainzngs only limits the combined rate
+            if any(mirror.delay == 0 for mirror in pool.mirrors):
+                musicbrainzngs.set_rate_limit(False)
+            else:
+                musicbrainzngs.set_rate_limit(1, math.ceil(sum(1 / mirror.delay for mirror in pool.mirrors)))
+            self._mirror_pool = pool
+        return self._mirror_pool
+
+    def _get_entity_cache(self) -> EntityCache:
+        """Open the cache on first use. If disabled, the cache only lasts for this run"""
+        if self._entity_cache is None:
+            path = ':memory:'
+            if self.config['cache']:
+                path = self.config['cache_file'].as_filename() if self.config['cache_file'].get() \
+                    else os.path.join(config.config_dir(), 'oldestdate_cache.db')
+            self._entity_cache = EntityCache(path, self.config['cache_ttl'].as_number(),
+                                             self.config['negative_cache_ttl'].as_number())
+        return self._entity_cache
+
+    def _get_index_path(self) -> str:
+        return self.config['index_file'].as_filename() if self.config['index_file'].get() \
+            else os.path.join(config.config_dir(), 'oldestdate_index.db')
+
+    def _get_dump_index(self) -> 'DumpIndex':
+        if self._dump_index is None:
+            from .dump_index import DumpIndex
+
+            try:
+                self._dump_index = DumpIndex(self._get_index_path())
+            except FileNotFoundError as e:
+                raise ui.UserError(str(e))
+        return self._dump_index
+
+    def _read_cache(self, kind: str, entity_id: str) -> Any:
+        """
+        Read from the persistent cache, raising KeyError if missing.
+        With force, only entries written during this run are used, so that everything is fetched fresh.
+        """
+        if self.config['force'] and (kind, entity_id) not in self._cached_this_run:
+            raise KeyError((kind, entity_id))
+        return self._get_entity_cache().get(kind, entity_id)
+
+    def _write_cache(self, kind: str, entity_id: str, value: Any, negative: bool = False) -> None:
+        self._get_entity_cache().put(kind, entity_id, value, negative)
+        self._cached_this_run.add((kind, entity_id))
+
+    @staticmethod
+    def _is_not_found(error: Exception) -> bool:
+        """Whether a musicbrainzngs ResponseError means the entity does not exist, e.g. it was deleted"""
+        return getattr(getattr(error, 'cause', None), 'code', None) == 404
+
+    def _get_json_transport(self) -> JsonTransport:
+        if self._json_transport is None:
+            self._json_transport = JsonTransport('{0}/{1} ( {2} )'.format(*USER_AGENT),
+                                                 timeout=self.config['http_timeout'].as_number(),
+                                                 pool_size=self.config['http_pool_size'].get(int))
+        return self._json_transport
+
     T = TypeVar('T')
+    @staticmethod
+    def _on_mirror(func: Callable[..., T]) -> Callable[..., T]:
+        """Adapt a musicbrainzngs function so that it can be called with the mirror to use as first argument"""
+        def call(mirror: Mirror, *args: Any, **kwargs: Any) -> Any:
+            import musicbrainzngs
+
+            # Otherwise another thread could switch the host before the request is made
+            with OldestDatePlugin._hostname_lock:
+                musicbrainzngs.set_hostname(mirror.host, mirror.https)
+                return func(*args, **kwargs)
+        return call
+
     def _retry_on_network_error(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
-        max_retries: int = self.config['max_network_retries'].get()
+        """
+        Call func with a mirror from the pool, followed by the given arguments.
+        On network errors, fail over to other mirrors.
+        """
+        import musicbrainzngs
+
+        mirror_pool = self._get_mirror_pool()
+        # Make sure every mirror gets a chance before giving up
+        max_retries: int = max(self.config['max_network_retries'].get(int), len(mirror_pool))
         for attempt in range(max_retries):
+            mirror = mirror_pool.acquire()
+            self._total_requests += 1
             try:
-                return func(*args, **kwargs)
-            except NetworkError:
+                result = func(mirror, *args, **kwargs)
+            except musicbrainzngs.NetworkError:
+                mirror_pool.report_failure(mirror)
                 if attempt < max_retries - 1:  # No need to wait after the last attempt
+                    if mirror_pool.has_healthy():  # Fail over straight away
+                        self._log.info(f'Network call to {mirror.host} failed, attempt {attempt}/{max_retries}. '
+                                       f'Trying another mirror')
+                        continue
                     delay: int = 2 ** attempt
                     self._log.info(f'Network call failed, attempt {attempt}/{max_retries}. Trying again in {delay}')
                     time.sleep(delay)  # Exponential backoff each attempt
                 else:
                     raise
+            else:
+                mirror_pool.report_success(mirror)
+                return result
         assert False, "Unreachable code"  # To satisfy mypy; this will never actually be reached
 
-    def _get_work_id_from_recording(self, recording: Recording) -> Optional[str]:
+    def _get_work_id_from_recording(self, recording: RecordingRecord) -> Optional[str]:
         """Extract first valid work_id from recording"""
-        work_id = None
-
-        if 'work-relation-list' in recording:
-            for work_rel in recording['work-relation-list']:
-                if 'work' in work_rel:
-                    current_work = work_rel['work']
-                    if 'id' in current_work:
-                        work_id = current_work['id']
-                        break
-
-        return work_id
+        return recording.work_ids[0] if recording.work_ids else None
 
-    def _contains_artist(self, recording: Recording, artist_ids: List[str]) -> bool:
+    def _contains_artist(self, recording: RecordingRecord, artist_ids: List[str]) -> bool:
         """Returns whether this recording contains at least one of the specified artists"""
-        artist_found = False
-        if 'artist-credit' in recording:
-            for artist in recording['artist-credit']:
-                if 'artist' in artist:
-                    artist = artist['artist']
-                    if 'id' in artist and artist['id'] in artist_ids:  # Contains at least one of the identified artists
-                        artist_found = True
-                        break
-        return artist_found
+        return any(artist_id in artist_ids for artist_id in recording.artist_ids)
 
-    def _get_artist_ids_from_recording(self, recording: Recording) -> List[str]:
+    def _get_artist_ids_from_recording(self, recording: RecordingRecord) -> List[str]:
         """Extract artist ids from a recording"""
-        ids = []
-
-        if 'artist-credit' in recording:
-            for artist in recording['artist-credit']:
-                if 'artist' in artist:
-                    artist = artist['artist']
-                    if 'id' in artist:
-                        ids.append(artist['id'])
-        return ids
+        return list(recording.artist_ids)
 
-    def _is_cover(self, recording: Recording) -> bool:
+    def _is_cover(self, recording: RecordingRecord) -> bool:
         """Returns whether given fetched recording is a cover of a work"""
-        if 'work-relation-list' in recording:
-            for work in recording['work-relation-list']:
-                if 'attribute-list' in work:
-                    if 'cover' in work['attribute-list']:
-                        return True
-        return False
-
-    def _fetch_work(self, work_id: str) -> Work:
-        """Fetch work, including recording relations"""
-        work: Work = self._retry_on_network_error(
-            musicbrainzngs.get_work_by_id,
-            work_id,
-            includes=['recording-rels']
-        )['work']
+        return recording.is_cover
+
+    def _fetch_work(self, work_id: str) -> Optional[WorkRecord]:
+        """Fetch and cache work, including recording relations. None if the work does not exist"""
+        if self.config['offline']:
+            return self._get_dump_index().get_work(work_id)
+
+        import musicbrainzngs
+
+        self._budget.requests += 1
+        work: Optional[WorkRecord] = None
+        try:
+            if self.config['transport'].get() == 'json':
+                work = WorkRecord.from_ws_json(self._retry_on_network_error(
+                    self._get_json_transport().get, 'work', work_id, ['recording-rels']))
+            else:
+                work = WorkRecord.from_mb(self._retry_on_network_error(
+                    self._on_mirror(musicbrainzngs.get_work_by_id),
+                    work_id,
+                    includes=['recording-rels']
+                )['work'])
+        except musicbrainzngs.ResponseError as e:
+            if not self._is_not_found(e):
+                raise
+            self._log.warning('Work {0} not found on MusicBrainz', work_id)
+
+        # Works without recordings are dead ends, so check them again sooner
+        self._write_cache('work', work_id, None if work is None else work.to_json(),
+                          negative=work is None or not work.recordings)
+        if work is not None:
+            self._get_entity_cache().link('recording_work', ((relation.id, work.id) for relation in work.recordings))
         return work
 
+    def _get_work(self, work_id: str) -> Optional[WorkRecord]:
+        """Get work from cache or MusicBrainz"""
+        if self.config['offline']:  # The index is already local
+            return self._fetch_work(work_id)
+        try:
+            return WorkRecord.from_json(self._read_cache('work', work_id))
+        except KeyError:
+            return self._fetch_work(work_id)
+
     def _has_work_id(self, recording_id: str) -> bool:
         """Return whether the recording has a work id"""
         recording = self._get_recording(recording_id)
-        work_id = self._get_work_id_from_recording(recording)
-        return work_id is not None
+        return recording is not None and self._get_work_id_from_recording(recording) is not None
 
-    def _command_func(self, lib: Library, _: ImportSession, args: List[str]) -> None:
+    def _command_func(self, lib: Library, opts: optparse.Values, args: List[str]) -> None:
         """This queries the local database, not the files."""
-        for item in lib.items(args):
-            self._process_file(item)
+        if sum(bool(option) for option in (opts.export, opts.apply, opts.prefetch, opts.watch)) > 1:
+            raise ui.UserError('Only one of --export, --apply, --prefetch and --watch can be used at a time')
+
+        if opts.apply:
+            self._apply_results(lib, opts.apply, args)
+            return
+
+        self._lib = lib
+        shard = self._parse_shard(opts.shard) if opts.shard else None
+
+        if opts.watch:
+            self._watch(lib, args, shard)
+            self._log_statistics()
+            return
+
+        items = self._filter_shard(lib.items(args), shard)
+        if opts.prefetch:
+            self._prefetch(items)
+        elif opts.export:
+            self._export_results(items, opts.export)
+        else:
+            for item in items:
+                self._process_file(item)
+        self._log_statistics()
+
+    def _index_command_func(self, lib: Library, opts: optparse.Values, args: List[str]) -> None:
+        """Build the offline index from the given dump files"""
+        from .dump_index import DumpIndex
+
+        if not args:
+            raise ui.UserError('Specify the recording, work and release dumps to index')
+
+        path = self._get_index_path()
+        if self._dump_index is not None:  # Don't keep reading the index being replaced
+            self._dump_index.close()
+            self._dump_index = None
+
+        def progress(entity_type: str, count: int) -> None:
+            self._log.debug('Indexed {0} {1} entities', count, entity_type)
+
+        try:
+            counts = DumpIndex.build(path, args, progress)
+        except (OSError, ValueError) as e:
+            raise ui.UserError(f'Could not build index: {e}')
+        self._log.info('Indexed {0} recordings, {1} works and {2} releases into {3}',
+                       counts['recording'], counts['work'], counts['release'], path)
+
+    def _invalidate_command_func(self, lib: Library, opts: optparse.Values, args: List[str]) -> None:
+        """Invalidate what depends on the changed entities listed in the given files"""
+        if not args:
+            raise ui.UserError('Specify the files listing changed entities, or - to read from standard input')
+
+        changed = self._read_changed_ids(args)
+        recording_ids, work_ids = self._invalidate_cache(changed)
+        stale_count = self._mark_stale(lib, recording_ids, work_ids)
+        self._log.info('Invalidated {0} recordings and {1} works, {2} tracks will be resolved again',
+                       len(recording_ids), len(work_ids), stale_count)
+
+    @staticmethod
+    def _read_changed_ids(paths: List[str]) -> Dict[str, Set[str]]:
+        """
+        Read changed entities, one per line as the entity type (recording, work or release) and id, e.g. from
+        replication packets. Blank lines and lines starting with # are skipped.
+        """
+        changed: Dict[str, Set[str]] = {entity_type: set() for entity_type in ENTITY_TYPES}
+        for path in paths:
+            try:
+                # Standard input is not ours to close
+                file = contextlib.nullcontext(sys.stdin) if path == '-' else open(path)
+            except OSError as e:
+                raise ui.UserError(f'Could not read {path}: {e}')
+            with file as lines:
+                for line_number, line in enumerate(lines, 1):
+                    fields = line.split()
+                    if not fields or fields[0].startswith('#'):
+                        continue
+                    if len(fields) != 2 or fields[0] not in changed:
+                        raise ui.UserError(f'Invalid change on line {line_number} of {path}, '
+                                           f'expected one of {", ".join(ENTITY_TYPES)} followed by an id')
+                    changed[fields[0]].add(fields[1])
+        return changed
+
+    def _invalidate_cache(self, changed: Dict[str, Set[str]]) -> Tuple[Set[str], Set[str]]:
+        """
+        Remove cached entities that changed, along with the works they belong to and the dates found for them.
+        :return: The recordings and works whose oldest date may have changed
+        """
+        cache = self._get_entity_cache()
+        # A changed release changes the release dates of the recordings on it
+        changed_recordings = changed['recording'] | cache.linked_from('release_recording', changed['release'])
+        # The oldest date of a work depends on all of its recordings
+        affected_works = changed['work'] | cache.linked_from('recording_work', changed_recordings)
+        affected_recordings = changed_recordings | cache.linked_to('recording_work', affected_works)
+
+        cache.delete('recording', changed_recordings)
+        cache.delete('work', affected_works)
+        cache.delete('no_date', affected_recordings)
+        for recording_id in changed_recordings:
+            self._recordings_cache.pop(recording_id, None)
+        return affected_recordings, affected_works
+
+    @staticmethod
+    def _mark_stale(lib: Library, recording_ids: Set[str], work_ids: Set[str]) -> int:
+        """Flag processed items of the given recordings or works to be resolved again. Returns how many"""
+        queries = [MatchQuery('mb_trackid', recording_id) for recording_id in recording_ids] + \
+                  [MatchQuery('mb_workid', work_id) for work_id in work_ids]
+        stale: Set[int] = set()
+        with lib.transaction():
+            for query in OldestDatePlugin._any_of(queries):
+                for item in lib.items(query):
+                    if item.get('recording_year') and item.id not in stale:
+                        item['recording_date_stale'] = 1
+                        item.store()
+                        stale.add(item.id)
+        return len(stale)
+
+    @staticmethod
+    def _any_of(queries: List[MatchQuery]) -> Iterator[OrQuery]:
+        """Split a disjunction into chunks, to stay within SQLite's expression depth limit"""
+        for start in range(0, len(queries), 500):
+            yield OrQuery(queries[start:start + 500])
+
+    def _log_statistics(self) -> None:
+        """Log how much network work the run needed"""
+        message = f'{self._total_requests} MusicBrainz requests'
+        if self._json_transport is not None:
+            pool = self._json_transport.pool
+            message += f', {pool.opened} connections opened, {pool.reused} requests on reused connections'
+        self._log.info(message)
+
+    @staticmethod
+    def _parse_shard(spec: str) -> Tuple[int, int]:
+        """Parse a shard specification of the form I/N into a 0-based index and a count"""
+        try:
+            index_string, count_string = spec.split('/')
+            index, count = int(index_string), int(count_string)
+        except ValueError:
+            raise ui.UserError(f'Invalid shard {spec}, expected I/N, e.g. 1/4')
+        if count < 1 or not 1 <= index <= count:
+            raise ui.UserError(f'Invalid shard {spec}, I must be between 1 and N')
+        return index - 1, count
+
+    def _filter_shard(self, items: Iterable[Item], shard: Optional[Tuple[int, int]]) -> Iterable[Item]:
+        """Only keep the items of the given shard index and count, if any"""
+        if shard is None:
+            return items
+        shard_index, shard_count = shard
+        return (item for item in items if self._get_shard(item, shard_count) == shard_index)
+
+    @staticmethod
+    def _get_shard(item: Item, shard_count: int) -> int:
+        """
+        Deterministically assign an item to a 0-based shard.
+        Items of the same work share a shard, so the work only has to be fetched on one node.
+        """
+        key = item.get('mb_workid') or item.mb_trackid or ''
+        return zlib.crc32(key.encode('utf-8')) % shard_count
+
+    def _export_results(self, items: Iterable[Item], path: str) -> None:
+        """Compute dates for the given items and stream them to a JSON lines file"""
+        with open(path, 'w', encoding='utf-8') as results_file:
+            for item in items:
+                result = self._compute_result(item)
+                if result is None:
+                    continue
+                results_file.write(json.dumps(result) + '\n')
+                results_file.flush()  # Keep partial results if the run is interrupted
+
+    def _prefetch(self, items: Iterable[Item]) -> None:
+        """
+        Download the recordings and works that resolving the items will need into the persistent cache,
+        including the recordings of each work whose releases would be looked at, without resolving any dates.
+        """
+        if not self.config['cache'] or self.config['offline']:
+            raise ui.UserError('--prefetch needs the cache enabled and offline mode disabled')
+
+        import musicbrainzngs
+
+        fetched = {'recording': 0, 'work': 0}
+        failed = {'recording': 0, 'work': 0}
+        seen: Set[str] = set()
+
+        def prefetch(kind: str, entity_id: str, fetch: Callable[[str], Any]) -> Any:
+            try:
+                result = fetch(entity_id)
+            except musicbrainzngs.WebServiceError as e:
+                # Resolving will try again, so keep going with the rest
+                self._log.error('Could not prefetch {0} {1}: {2}', kind, entity_id, e)
+                failed[kind] += 1
+                return None
+            fetched[kind] += 1
+            return result
+
+        def prefetch_recording(recording_id: str) -> Optional[RecordingRecord]:
+            seen.add(recording_id)
+            try:
+                recording = self._get_cached_recording(recording_id)
+            except KeyError:
+                recording = prefetch('recording', recording_id, self._fetch_recording)
+            self._recordings_cache.pop(recording_id, None)  # Only keep it in the persistent cache
+            return recording
+
+        # Work id to whether the items' recordings of it are covers, which decides the recordings looked at
+        works: Dict[str, Set[bool]] = {}
+        for item in items:
+            if not item.mb_trackid or item.data_source != 'MusicBrainz' or item.mb_trackid in seen \
+                    or self._is_processed(item):
+                continue
+            recording = prefetch_recording(item.mb_trackid)
+            work_id = None if recording is None else self._get_work_id_from_recording(recording)
+            if recording is not None and work_id is not None:
+                works.setdefault(work_id, set()).add(self._is_cover(recording))
+
+        fetch_releases = self.config['approach'].get() != 'recordings'
+        for work_id, cover_flags in works.items():
+            try:
+                work = WorkRecord.from_json(self._read_cache('work', work_id))
+            except KeyError:
+                work = prefetch('work', work_id, self._fetch_work)
+            if work is None or not fetch_releases:
+                continue
+            for is_cover in cover_flags:
+                for rec in self._release_candidates(work.recordings, is_cover):
+                    if rec.id not in seen:
+                        prefetch_recording(rec.id)
+
+        self._log.info('Prefetched {0} recordings and {1} works, {2} recordings and {3} works were already cached',
+                       fetched['recording'], fetched['work'], len(seen) - fetched['recording'] - failed['recording'],
+                       len(works) - fetched['work'] - failed['work'])
+        if failed['recording'] or failed['work']:
+            self._log.warning('Could not prefetch {0} recordings and {1} works', failed['recording'], failed['work'])
+
+    def _watch(self, lib: Library, query_parts: List[str], shard: Optional[Tuple[int, int]]) -> None:
+        """
+        Resolve the matching items, then keep polling for items added since and resolve them as they come.
+        Staying resident keeps the caches, mirrors and connections warm between items.
+        """
+        query, _ = parse_query_parts(query_parts, Item)
+        interval = self.config['watch_interval'].as_number()
+        pending: Set[int] = set()
+        since = self._process_added_since(lib, query, shard, None, pending)
+        self._log.info('Watching for new items every {0} seconds, press Ctrl+C to stop', interval)
+        try:
+            while True:
+                time.sleep(interval)
+                since = self._process_added_since(lib, query, shard, since, pending)
+        except KeyboardInterrupt:
+            self._log.info('Stopped watching')
+
+    def _process_added_since(self, lib: Library, query: Query, shard: Optional[Tuple[int, int]],
+                             since: Optional[float], pending: Set[int]) -> float:
+        """
+        Resolve the items matching the query that were added after since, or all of them if None.
+        New items whose files have not reached the library yet are put in pending, and tried again on the next call,
+        for up to watch_max_wait seconds after they were added.
+        :return: When the most recently added item seen so far was added
+        """
+        import musicbrainzngs
+
+        def process(item: Item, wait_for_file: bool, waited: bool = False) -> None:
+            try:
+                self._process_added_item(lib, item, pending if wait_for_file else None, waited)
+            except musicbrainzngs.WebServiceError as e:
+                # Keep watching, a later run without --watch will pick the item up again
+                self._log.error('Could not resolve {0.artist} - {0.title}: {1}', item, e)
+            except FileOperationError as e:
+                self._log.error('Could not write {0.artist} - {0.title}: {1}', item, e)
+
+        waiting = [lib.get_item(item_id) for item_id in pending]
+        pending.clear()
+        for item in waiting:
+            if item is not None:  # Unless it was removed meanwhile
+                process(item, True, True)
+
+        if since is not None:
+            query = AndQuery([query, NumericQuery('added', f'{since!r}..')])
+        latest = since or 0.0
+        for item in self._filter_shard(lib.items(query), shard):
+            if since is not None and item.added <= since:  # The range includes its start
+                continue
+            latest = max(latest, item.added)
+            # Items there before watching started are resolved like a regular run would
+            process(item, since is not None)
+        return latest
+
+    def _process_added_item(self, lib: Library, item: Item, pending: Optional[Set[int]], waited: bool = False) -> None:
+        """
+        Resolve an item picked up by --watch. Imports add items with their source path before copying or moving
+        the files into the library, so an item whose file is still outside the library is put in pending rather than
+        writing tags to the source file. Files can also stay where they are, e.g. when imported with -C, so waiting
+        stops watch_max_wait seconds after the item was added.
+        :param waited: Whether the item was pending before
+        """
+        path = util.displayable_path(item.path)
+        if pending is not None and self._is_outside_library(lib, item):
+            waited_seconds = time.time() - item.added
+            if waited_seconds < self.config['watch_max_wait'].as_number():
+                self._log.debug('Waiting for {0} to be added to the library', path)
+                pending.add(item.id)
+                return
+            self._log.warning('{0} is still outside the library after {1:.0f} seconds, resolving it where it is',
+                              path, waited_seconds)
+        elif waited:
+            self._log.info('{0} was added to the library, resolving it', path)
+
+        result = self._compute_result(item)
+        if result is None:
+            return
 
-    def _on_import(self, _: ImportSession, task: ImportTask) -> None:
+        # Another process may have changed the item while the date was resolved. item.load() only notices changes
+        # made by this process, so read it again
+        current = lib.get_item(item.id)
+        if current is None:
+            return
+        self._apply_date(current, DateWrapper(result['year'], result['month'], result['day']), result['approximate'])
+        current.store()
+        current.write()
+
+    @staticmethod
+    def _is_outside_library(lib: Library, item: Item) -> bool:
+        """Whether the item's file is outside the library directory, although imports transfer files into it"""
+        transfers = any(config['import'][option].get() for option in ('copy', 'move', 'link', 'hardlink', 'reflink'))
+        return bool(transfers) and lib.directory not in util.ancestry(item.path)
+
+    def _read_results(self, path: str) -> Iterator[Result]:
+        """Read results from a JSON lines file, skipping blank lines"""
+        with open(path, encoding='utf-8') as results_file:
+            for line_number, line in enumerate(results_file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    self._log.error('Could not parse line {0} of {1}', line_number, path)
+
+    def _apply_results(self, lib: Library, path: str, query: List[str]) -> None:
+        """Apply previously exported results in a single database transaction, then write the files"""
+        allowed_ids = {item.id for item in lib.items(query)} if query else None
+        changed_items = []
+
+        with lib.transaction():
+            for result in self._read_results(path):
+                if allowed_ids is not None and result.get('id') not in allowed_ids:
+                    continue
+                item = lib.get_item(result.get('id'))
+                # The library may have changed since the results were computed
+                if item is None or item.mb_trackid != result.get('recording_id'):
+                    self._log.warning('Skipping stale result for item {0}', result.get('id'))
+                    continue
+                if result.get('year') is None:
+                    continue
+
+                self._apply_date(item, DateWrapper(result['year'], result.get('month'), result.get('day')),
+                                 result.get('approximate', False))
+                item.store()
+                changed_items.append(item)
+
+        for item in changed_items:
+            item.try_write()
+
+    def _on_import(self, session: ImportSession, task: ImportTask) -> None:
         if self.config['auto']:
             self._importing = True
+            self._lib = session.lib
             for item in task.imported_items():
                 self._process_file(item)
 
     def _process_file(self, item: Item) -> None:
-        if not item.mb_trackid or item.data_source != 'MusicBrainz':
-            self._log.info('Skipping track with no mb_trackid: {0.artist} - {0.title}', item)
+        result = self._compute_result(item)
+        if result is None:
             return
 
+        self._apply_date(item, DateWrapper(result['year'], result['month'], result['day']), result['approximate'])
+        item.store()
+        # Prevent changing file on disk before it reaches final destination
+        if not self._importing:
+            item.write()
+
+    def _is_processed(self, item: Item) -> bool:
+        """Whether the item already has a final date, so that it is skipped"""
         # Check for the recording_year and if it exists and not empty skips the track (if force is not True)
-        if 'recording_year' in item and item.recording_year and not self.config['force']:
+        # Approximate dates are refined, and stale dates resolved again, on later runs
+        return bool('recording_year' in item and item.recording_year and not self.config['force']
+                    and not item.get('recording_date_approximate') and not item.get('recording_date_stale'))
+
+    def _compute_result(self, item: Item) -> Optional[Result]:
+        """Resolve the oldest date for an item without modifying it"""
+        if not item.mb_trackid or item.data_source != 'MusicBrainz':
+            self._log.info('Skipping track with no mb_trackid: {0.artist} - {0.title}', item)
+            return None
+
+        if self._is_processed(item):
             self._log.info('Skipping already processed track: {0.artist} - {0.title}', item)
-            return
+            return None
+
+        # Fetching the item's own recording counts against its budget too
+        self._reset_budget()
+        recording = self._get_recording(item.mb_trackid)
+        work_id = None if recording is None else self._get_work_id_from_recording(recording)
 
         # Get oldest date from MusicBrainz
         oldest_date = self._get_oldest_date(item.mb_trackid, DateWrapper(item.year, item.month, item.day))
 
         if not oldest_date:
             self._log.error('No date found for {0.artist} - {0.title}', item)
-            return
+            return None
+
+        return {
+            'id': item.id,
+            'recording_id': item.mb_trackid,
+            'work_id': work_id,
+            'year': oldest_date.y,
+            'month': oldest_date.m,
+            'day': oldest_date.d,
+            'source': self._budget.approach or self.config['approach'].get(),
+            'approximate': self._budget.approximate,
+        }
+
+    def _apply_date(self, item: Item, oldest_date: DateWrapper, approximate: bool = False) -> None:
+        """Set the recording fields, and optionally the date, of an item. Does not store it."""
+        if approximate:
+            item['recording_date_approximate'] = 1
+        elif 'recording_date_approximate' in item:
+            del item['recording_date_approximate']
+        if 'recording_date_stale' in item:
+            del item['recording_date_stale']
 
         if oldest_date.y is not None:
             item['recording_year'] = oldest_date.y
@@ -253,55 +858,97 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
             item.day = "" if (oldest_date.d is None or not self.config['overwrite_day']) else day_string
 
         self._log.info('Applying changes to {0.artist} - {0.title}', item)
-        item.store()
-        # Prevent changing file on disk before it reaches final destination
-        if not self._importing:
-            item.write()
 
-    def _fetch_recording(self, recording_id: str) -> Recording:
-        """Fetch and cache recording from MusicBrainz, including releases and work relations"""
-        recording: Recording = self._retry_on_network_error(
-            musicbrainzngs.get_recording_by_id,
-            recording_id,
-            includes=['artists', 'releases', 'work-rels']
-        )['recording']
+    def _fetch_recording(self, recording_id: str) -> Optional[RecordingRecord]:
+        """
+        Fetch and cache recording from MusicBrainz, including releases and work relations.
+        None if the recording does not exist.
+        """
+        recording: Optional[RecordingRecord] = None
+        if self.config['offline']:
+            recording = self._get_dump_index().get_recording(recording_id)
+            self._recordings_cache[recording_id] = recording
+            return recording
+
+        import musicbrainzngs
+
+        self._budget.requests += 1
+        try:
+            if self.config['transport'].get() == 'json':
+                recording = RecordingRecord.from_ws_json(self._retry_on_network_error(
+                    self._get_json_transport().get, 'recording', recording_id, ['artists', 'releases', 'work-rels']))
+            else:
+                recording = RecordingRecord.from_mb(self._retry_on_network_error(
+                    self._on_mirror(musicbrainzngs.get_recording_by_id),
+                    recording_id,
+                    includes=['artists', 'releases', 'work-rels']
+                )['recording'])
+        except musicbrainzngs.ResponseError as e:
+            if not self._is_not_found(e):
+                raise
+            self._log.warning('Recording {0} not found on MusicBrainz', recording_id)
 
         self._recordings_cache[recording_id] = recording
+        # Recordings without a work are dead ends, so check them again sooner in case a work gets added
+        self._write_cache('recording', recording_id, None if recording is None else recording.to_json(),
+                          negative=recording is None or not recording.work_ids)
+        if recording is not None:
+            self._link_recording(recording)
         return recording
 
-    def _get_recording(self, recording_id: str) -> Recording:
+    def _link_recording(self, recording: RecordingRecord) -> None:
+        """Remember which releases and works the recording belongs to, so that changes to them can be invalidated"""
+        cache = self._get_entity_cache()
+        cache.link('release_recording', ((release.id, recording.id) for release in recording.releases if release.id))
+        cache.link('recording_work', ((recording.id, work_id) for work_id in recording.work_ids))
+
+    def _get_cached_recording(self, recording_id: str) -> Optional[RecordingRecord]:
+        """
+        Get recording from the in-memory or persistent cache, without fetching it.
+        Raises KeyError if not cached, returns None if the recording is known not to exist.
+        """
+        if recording_id in self._recordings_cache:
+            return self._recordings_cache[recording_id]
+        if self.config['offline']:  # The index is already local
+            raise KeyError(recording_id)
+        return RecordingRecord.from_json(self._read_cache('recording', recording_id))
+
+    def _is_cached(self, recording_id: str) -> bool:
+        """Whether the recording can be looked up without a request"""
+        try:
+            self._get_cached_recording(recording_id)
+        except KeyError:
+            return False
+        return True
+
+    def _get_recording(self, recording_id: str) -> Optional[RecordingRecord]:
         """Get recording from cache or MusicBrainz"""
-        return self._recordings_cache[
-            recording_id] if recording_id in self._recordings_cache else self._fetch_recording(recording_id)
+        try:
+            return self._get_cached_recording(recording_id)
+        except KeyError:
+            return self._fetch_recording(recording_id)
 
-    def _extract_oldest_recording_date(self, recordings: List[Recording], starting_date: DateWrapper,
+    def _extract_oldest_recording_date(self, recordings: Sequence[RecordingRelation], starting_date: DateWrapper,
                                        is_cover: bool, approach: str) -> DateWrapper:
         """Get oldest date from a recording"""
         oldest_date = starting_date
 
         for rec in recordings:
-            if 'recording' not in rec:
-                continue
-            rec_id = rec['recording']
-            if 'id' not in rec_id:
-                continue
-            rec_id = rec_id['id']
+            rec_id = rec.id
 
             # If a cover, filter recordings to only keep covers. Otherwise, remove covers
-            if is_cover != ('attribute-list' in rec and 'cover' in rec['attribute-list']):
+            if is_cover != ('cover' in rec.attributes):
                 # We can't filter by author here without fetching each individual recording.
                 self._recordings_cache.pop(rec_id, None)  # Remove recording from cache
                 continue
 
-            if 'begin' in rec:
-                date = rec['begin']
-                if date:
-                    try:
-                        date = DateWrapper(iso_string=date)
-                        if date < oldest_date:
-                            oldest_date = date
-                    except ValueError:
-                        self._log.error("Could not parse date {0} for recording {1}", date, rec)
+            if rec.begin:
+                try:
+                    date = DateWrapper(iso_string=rec.begin)
+                    if date < oldest_date:
+                        oldest_date = date
+                except ValueError:
+                    self._log.error("Could not parse date {0} for recording {1}", rec.begin, rec_id)
 
             # Remove recording from cache if no longer needed
             if approach == 'recordings' or (approach == 'hybrid' and oldest_date != starting_date):
@@ -309,62 +956,176 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
 
         return oldest_date
 
-    def _extract_oldest_release_date(self, recordings: List[Recording], starting_date: DateWrapper,
+    def _extract_oldest_release_date(self, recordings: Sequence[RecordingRelation], starting_date: DateWrapper,
                                      is_cover: bool, artist_ids: List[str]) -> DateWrapper:
         """Get oldest date from a release"""
         oldest_date = starting_date
         release_types = self.config['release_types'].get()
+        # Once out of budget, keep going with the recordings known locally instead of stopping
+        use_local = self.config['local_releases'].get(bool)
+        self._budget.local_recordings = None
 
         for rec in recordings:
-            rec_id = rec['recording'] if 'recording' in rec else rec
-            if 'id' not in rec_id:
-                continue
-            rec_id = rec_id['id']
-
+            rec_id = rec.id
             fetched_recording = None
 
             # Shorten recordings list, but if song is a cover, only keep covers
             if is_cover:
-                if 'attribute-list' not in rec or 'cover' not in rec['attribute-list']:
+                if 'cover' not in rec.attributes:
                     self._recordings_cache.pop(rec_id, None)  # Remove recording from cache
                     continue
                 else:
                     # Filter by artist, but only if cover (to avoid not matching solo careers of former groups)
-                    fetched_recording = self._get_recording(rec_id)
+                    fetched_recording = self._get_recording_within_budget(rec_id, recordings)
+                    if fetched_recording is None:
+                        if self._budget.approximate and not use_local:  # Out of budget
+                            break
+                        continue
                     if not self._contains_artist(fetched_recording, artist_ids):
                         self._recordings_cache.pop(rec_id, None)  # Remove recording from cache
                         continue
-            elif 'attribute-list' in rec and (self.config['filter_recordings'] or 'cover' in rec['attribute-list']):
+            elif rec.attributes and (self.config['filter_recordings'] or 'cover' in rec.attributes):
                 self._recordings_cache.pop(rec_id, None)  # Remove recording from cache
                 continue
 
             if not fetched_recording:
-                fetched_recording = self._get_recording(rec_id)
-
-            if 'release-list' in fetched_recording:
-                for release in fetched_recording['release-list']:
-                    if release_types is None or (  # Filter by recording type, i.e. Official
-                            'status' in release and release['status'] in release_types):
-                        if 'date' in release:
-                            release_date = release['date']
-                            if release_date:
-                                try:
-                                    date = DateWrapper(iso_string=release_date)
-                                    if date < oldest_date:
-                                        oldest_date = date
-                                except ValueError:
-                                    self._log.error("Could not parse date {0} for recording {1}", release_date, rec)
+                fetched_recording = self._get_recording_within_budget(rec_id, recordings)
+                if fetched_recording is None:
+                    if self._budget.approximate and not use_local:  # Out of budget
+                        break
+                    self._recordings_cache.pop(rec_id, None)
+                    continue
+
+            for release in fetched_recording.releases:
+                # Filter by recording type, i.e. Official
+                if release.date and (release_types is None or release.status in release_types):
+                    try:
+                        date = DateWrapper(iso_string=release.date)
+                        if date < oldest_date:
+                            oldest_date = date
+                    except ValueError:
+                        self._log.error("Could not parse date {0} for recording {1}", release.date, rec_id)
 
             self._recordings_cache.pop(rec_id, None)  # Remove recording from cache
 
         return oldest_date
 
-    def _iterate_dates(self, recordings: List[Recording], starting_date: DateWrapper,
+    @property
+    def _budget(self) -> ItemBudget:
+        """The budget of the item being resolved in this thread"""
+        budget: Optional[ItemBudget] = getattr(self._item_state, 'budget', None)
+        if budget is None:
+            budget = self._item_state.budget = ItemBudget()
+        return budget
+
+    def _reset_budget(self) -> None:
+        """Start a new request budget for the next item"""
+        self._item_state.budget = ItemBudget()
+
+    def _remaining_budget(self) -> Tuple[Optional[int], Optional[float]]:
+        """Requests and seconds left for the current item, None meaning unlimited"""
+        max_requests: Optional[int] = self.config['max_requests_per_item'].get()
+        max_seconds: Optional[float] = self.config['max_seconds_per_item'].get()
+        remaining_requests = None if max_requests is None else max_requests - self._budget.requests
+        remaining_seconds = None if max_seconds is None else max_seconds - (time.monotonic() - self._budget.start)
+        return remaining_requests, remaining_seconds
+
+    def _can_afford(self, requests: int) -> bool:
+        """Whether the given amount of requests fits in what is left of the item's budget"""
+        if self.config['offline']:  # Index lookups are not requests
+            return True
+        remaining_requests, remaining_seconds = self._remaining_budget()
+        if remaining_requests is not None and requests > remaining_requests:
+            return False
+        if remaining_seconds is not None:
+            # Estimate from the combined rate limit of all mirrors
+            mirrors = self._get_mirror_pool().mirrors
+            request_rate = sum(1 / mirror.delay if mirror.delay else math.inf for mirror in mirrors)
+            if requests / request_rate > remaining_seconds:
+                return False
+        return True
+
+    def _get_recording_within_budget(self, recording_id: str,
+                                     recordings: Sequence[RecordingRelation]) -> Optional[RecordingRecord]:
+        """
+        Get recording from cache, or fetch it if the budget allows.
+        Otherwise, mark the result as approximate and return the recording as known from the library if
+        local_releases is enabled, or None.
+        :param recordings: All recordings of the work, looked up in the library at once when first needed
+        """
+        try:
+            return self._get_cached_recording(recording_id)
+        except KeyError:
+            pass
+        if not self._can_afford(1):
+            self._budget.approximate = True
+            if not self.config['local_releases']:
+                return None
+            if self._budget.local_recordings is None:
+                self._budget.local_recordings = self._get_local_recordings([rec.id for rec in recordings])
+            return self._budget.local_recordings.get(recording_id)
+        return self._fetch_recording(recording_id)
+
+    def _get_local_recordings(self, recording_ids: List[str]) -> Dict[str, RecordingRecord]:
+        """
+        Build recordings from the library, with the artists of their tracks and the albums they are on as releases.
+        These only know about releases in the library, so they stand in for recordings that could not be fetched.
+        """
+        if self._lib is None:
+            return {}
+        items = [item for query in self._any_of([MatchQuery('mb_trackid', recording_id)
+                                                 for recording_id in set(recording_ids)])
+                 for item in self._lib.items(query)]
+        album_ids = {item.album_id for item in items if item.album_id}
+        albums = {album.id: album for query in self._any_of([MatchQuery('id', album_id) for album_id in album_ids])
+                  for album in self._lib.albums(query)}
+
+        artist_ids: Dict[str, Set[str]] = {}
+        releases: Dict[str, Dict[int, ReleaseRecord]] = {}
+        for item in items:
+            artist_ids.setdefault(item.mb_trackid, set())
+            releases.setdefault(item.mb_trackid, {})
+            if item.mb_artistid:
+                artist_ids[item.mb_trackid].add(item.mb_artistid)
+            album = albums.get(item.album_id)
+            if album is not None and album.year:
+                date = '{0:04d}'.format(album.year)
+                if album.month:
+                    date += '-{0:02d}'.format(album.month)
+                    if album.day:
+                        date += '-{0:02d}'.format(album.day)
+                releases[item.mb_trackid][album.id] = ReleaseRecord(date, album.albumstatus or None,
+                                                                    album.mb_albumid or None)
+
+        return {recording_id: RecordingRecord(recording_id, tuple(artist_ids[recording_id]),
+                                              releases=tuple(releases[recording_id].values()))
+                for recording_id in artist_ids}
+
+    def _release_candidates(self, recordings: Sequence[RecordingRelation], is_cover: bool) -> List[RecordingRelation]:
+        """Recordings that would be fetched when looking for release dates, before filtering covers by artist"""
+        if is_cover:
+            return [rec for rec in recordings if 'cover' in rec.attributes]
+        return [rec for rec in recordings
+                if not rec.attributes or not (self.config['filter_recordings'] or 'cover' in rec.attributes)]
+
+    def _iterate_dates(self, recordings: Sequence[RecordingRelation], starting_date: DateWrapper,
                        is_cover: bool, artist_ids: List[str]) -> Optional[DateWrapper]:
         """Iterates through a list of recordings and returns oldest date"""
         approach = self.config['approach'].get()
         oldest_date = starting_date
 
+        if approach == 'auto':
+            # Only fetch releases if the work is small enough for the budget, otherwise settle for recording dates.
+            # Cached recordings cost nothing, so a prefetched work always gets its release dates
+            uncached = [rec for rec in self._release_candidates(recordings, is_cover) if not self._is_cached(rec.id)]
+            if self._can_afford(len(uncached)):
+                approach = 'both'
+            else:
+                self._log.debug('Not enough budget to fetch releases of {0} recordings', len(uncached))
+                self._budget.approximate = True
+                approach = 'recordings'
+        self._budget.approach = approach
+
         # Look for oldest recording date
         if approach in ('recordings', 'hybrid', 'both'):
             oldest_date = self._extract_oldest_recording_date(recordings, starting_date, is_cover, approach)
@@ -376,7 +1137,33 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
         return None if oldest_date == DateWrapper.today() else oldest_date
 
     def _get_oldest_date(self, recording_id: str, item_date: Optional[DateWrapper]) -> Optional[DateWrapper]:
+        """
+        Get oldest date for a recording, skipping recordings already known to have no usable dates.
+        Requests count against the budget of the current item, see _reset_budget.
+        """
+        if self.config['offline']:  # Looking again is cheap, and the index may have been rebuilt since
+            return self._find_oldest_date(recording_id, item_date)
+        # A dead end only holds for the settings that decide which dates are looked at
+        settings = [self.config[key].get() for key in ('approach', 'release_types', 'filter_recordings',
+                                                       'use_file_date')]
+        try:
+            if self._read_cache('no_date', recording_id) == settings:
+                self._log.debug('Skipping recording {0}, no date was found last time', recording_id)
+                return None
+        except KeyError:
+            pass
+
+        oldest_date = self._find_oldest_date(recording_id, item_date)
+        if oldest_date is None and not self._budget.approximate:
+            self._write_cache('no_date', recording_id, settings, negative=True)
+        return oldest_date
+
+    def _find_oldest_date(self, recording_id: str, item_date: Optional[DateWrapper]) -> Optional[DateWrapper]:
         recording = self._get_recording(recording_id)
+        if recording is None:
+            self._log.error('Recording {0} does not exist on MusicBrainz', recording_id)
+            return None
+
         is_cover = self._is_cover(recording)
         work_id = self._get_work_id_from_recording(recording)
         artist_ids = self._get_artist_ids_from_recording(recording)
@@ -388,15 +1175,15 @@ class OldestDatePlugin(BeetsPlugin):  # type: ignore
                 self.config['use_file_date'] or not work_id) else today
 
         if not work_id:  # Only look through this recording
-            return self._iterate_dates([recording], starting_date, is_cover, artist_ids)
+            return self._iterate_dates([RecordingRelation(recording.id)], starting_date, is_cover, artist_ids)
 
         # Fetch work, including associated recordings
-        work = self._fetch_work(work_id)
+        work = self._get_work(work_id)
 
-        if 'recording-relation-list' not in work:
+        if work is None or not work.recordings:
             self._log.error(
                 'Work {0} has no valid associated recordings! Please choose another recording or amend the data!',
                 work_id)
             return None
 
-        return self._iterate_dates(work['recording-relation-list'], starting_date, is_cover, artist_ids)
+        return self._iterate_dates(work.recordings, starting_date, is_cover, artist_ids)
@@ -0,0 +1,71 @@
+"""
+Measure the memory used by the recordings of a large work, as full musicbrainzngs responses and as compact records.
+
+Responses are generated as web service XML and parsed with musicbrainzngs' own parser, so the dictionaries have the
+same shape as the ones returned by get_recording_by_id.
+
+Usage: python benchmarks/memory.py [recordings] [releases per recording]
+"""
+import os
+import sys
+import tracemalloc
+import uuid
+from typing import Any, Callable, List
+
+from musicbrainzngs import mbxml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from beetsplug.mb_records import RecordingRecord  # noqa: E402
+
+RELEASE = """<release id="{id}"><title>Greatest Hits Volume {index}</title><status id="{uuid}">Official</status>
+<quality>normal</quality><text-representation><language>eng</language><script>Latn</script></text-representation>
+<date>19{year:02d}-05-01</date><country>GB</country><release-event-list count="1"><release-event>
+<date>19{year:02d}-05-01</date><area id="{uuid}"><name>United Kingdom</name><sort-name>United Kingdom</sort-name>
+<iso-3166-1-code-list><iso-3166-1-code>GB</iso-3166-1-code></iso-3166-1-code-list></area></release-event>
+</release-event-list><barcode>5099{index:09d}</barcode></release>"""
+
+RECORDING = """<?xml version="1.0" encoding="UTF-8"?><metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#">
+<recording id="{id}"><title>Some Song</title><length>245000</length><artist-credit><name-credit>
+<artist id="{artist}"><name>Some Artist</name><sort-name>Artist, Some</sort-name></artist></name-credit>
+</artist-credit><release-list count="{count}">{releases}</release-list><relation-list target-type="work">
+<relation type="performance" type-id="{uuid}"><target>{work}</target><direction>forward</direction>
+<work id="{work}"><title>Some Song</title><language>eng</language></work></relation></relation-list>
+</recording></metadata>"""
+
+
+def generate_responses(recordings: int, releases: int) -> List[bytes]:
+    work_id, artist_id = str(uuid.uuid4()), str(uuid.uuid4())
+    responses = []
+    for _ in range(recordings):
+        release_xml = ''.join(RELEASE.format(id=uuid.uuid4(), uuid=uuid.uuid4(), index=index, year=index % 100)
+                              for index in range(releases))
+        responses.append(RECORDING.format(id=uuid.uuid4(), uuid=uuid.uuid4(), artist=artist_id, work=work_id,
+                                          count=releases, releases=release_xml).encode())
+    return responses
+
+
+def measure(responses: List[bytes], project: Callable[[Any], Any]) -> int:
+    """Bytes still allocated after parsing all responses and keeping their projections"""
+    tracemalloc.start()
+    kept = [project(mbxml.parse_message(response)['recording']) for response in responses]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main() -> None:
+    recordings = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    releases = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    responses = generate_responses(recordings, releases)
+
+    full = measure(responses, lambda recording: recording)
+    compact = measure(responses, RecordingRecord.from_mb)
+
+    print(f'{recordings} recordings with {releases} releases each')
+    print(f'Full responses:  {full / 2 ** 20:8.2f} MiB')
+    print(f'Compact records: {compact / 2 ** 20:8.2f} MiB ({full / compact:.1f}x smaller)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare the CPU time of turning a large work response into a compact record,
+between the XML used by musicbrainzngs and the JSON used by the json transport.
+
+Usage: python benchmarks/parsing.py [recordings] [runs]
+"""
+import json
+import os
+import sys
+import timeit
+import uuid
+from typing import Any, Dict, List
+
+from musicbrainzngs import mbxml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from beetsplug.json_transport import _keep_used_fields  # noqa: E402
+from beetsplug.mb_records import WorkRecord  # noqa: E402
+
+XML_RELATION = """<relation type="performance" type-id="{type_id}"><target>{id}</target><direction>backward</direction>
+<begin>19{year:02d}</begin><attribute-list><attribute>live</attribute></attribute-list><recording id="{id}">
+<title>Some Song (live at some venue)</title><length>245000</length><disambiguation>live</disambiguation></recording>
+</relation>"""
+
+XML_WORK = """<?xml version="1.0" encoding="UTF-8"?><metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#">
+<work id="{id}"><title>Some Song</title><language>eng</language><iswc-list><iswc>T-000.000.001-0</iswc></iswc-list>
+<relation-list target-type="recording">{relations}</relation-list></work></metadata>"""
+
+
+def generate(recordings: int) -> Dict[str, bytes]:
+    type_id, work_id = str(uuid.uuid4()), str(uuid.uuid4())
+    ids = [str(uuid.uuid4()) for _ in range(recordings)]
+    xml = XML_WORK.format(id=work_id, relations=''.join(
+        XML_RELATION.format(type_id=type_id, id=recording_id, year=index % 100)
+        for index, recording_id in enumerate(ids)))
+    relations: List[Dict[str, Any]] = [{
+        "type": "performance", "type-id": type_id, "target-type": "recording", "direction": "backward",
+        "begin": "19{0:02d}".format(index % 100), "end": None, "ended": False, "attributes": ["live"],
+        "attribute-values": {}, "attribute-ids": {"live": type_id}, "source-credit": "", "target-credit": "",
+        "recording": {"id": recording_id, "title": "Some Song (live at some venue)", "length": 245000,
+                      "disambiguation": "live", "video": False},
+    } for index, recording_id in enumerate(ids)]
+    work = {"id": work_id, "title": "Some Song", "language": "eng", "iswcs": ["T-000.000.001-0"],
+            "relations": relations}
+    return {'xml': xml.encode(), 'json': json.dumps(work).encode()}
+
+
+def main() -> None:
+    recordings = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    bodies = generate(recordings)
+
+    xml_record = WorkRecord.from_mb(mbxml.parse_message(bodies['xml'])['work'])
+    json_record = WorkRecord.from_ws_json(json.loads(bodies['json'], object_pairs_hook=_keep_used_fields))
+    assert [(r.id, r.begin, r.attributes) for r in xml_record.recordings] == \
+           [(r.id, r.begin, r.attributes) for r in json_record.recordings]
+
+    xml_time = min(timeit.repeat(lambda: WorkRecord.from_mb(mbxml.parse_message(bodies['xml'])['work']),
+                                 number=1, repeat=runs))
+    json_time = min(timeit.repeat(lambda: WorkRecord.from_ws_json(
+        json.loads(bodies['json'], object_pairs_hook=_keep_used_fields)), number=1, repeat=runs))
+
+    print(f'Work with {recordings} recordings, best of {runs} runs')
+    print(f'musicbrainzngs XML: {xml_time * 1000:8.2f} ms ({len(bodies["xml"]) / 1024:.0f} KiB)')
+    print(f'JSON:               {json_time * 1000:8.2f} ms ({len(bodies["json"]) / 1024:.0f} KiB, '
+          f'{xml_time / json_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Measure the startup cost the plugin adds to a beet invocation.
+
+Each sample runs in a fresh interpreter, which first imports the parts of beets that every command loads anyway,
+then times importing the plugin and creating it, as beets does when loading plugins.
+Bytecode caching is enabled, as it would be for an installed plugin.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+SAMPLE = """
+import time
+import beets.ui.commands
+start = time.perf_counter()
+from beetsplug.oldestdate import OldestDatePlugin
+OldestDatePlugin()
+print(time.perf_counter() - start)
+"""
+
+MODULES = """
+import sys
+import beets.ui.commands
+before = set(sys.modules)
+from beetsplug.oldestdate import OldestDatePlugin
+OldestDatePlugin()
+print(' '.join(sorted(name for name in set(sys.modules) - before if '.' not in name)))
+"""
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # Also warms up the bytecode cache
+    modules = subprocess.check_output([sys.executable, '-c', MODULES], env=env, cwd=root).decode().split()
+    samples = [float(subprocess.check_output([sys.executable, '-c', SAMPLE], env=env, cwd=root)) * 1000
+               for _ in range(runs)]
+
+    print(f'Plugin load time over {runs} runs: median {statistics.median(samples):.1f} ms, '
+          f'min {min(samples):.1f} ms, max {max(samples):.1f} ms')
+    print('Top-level modules imported by the plugin: ' + (', '.join(modules) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+
+from beetsplug.dump_index import DumpIndex, iterate_dump
+from beetsplug.mb_records import ReleaseRecord
+
+RECORDING = {"id": "recording-id", "title": "Song", "artist-credit": [{"artist": {"id": "artist-id"}}],
+             "relations": [{"target-type": "work", "work": {"id": "work-id"}, "begin": "1975",
+                            "attributes": ["live"]}]}
+COVER = {"id": "cover-id", "artist-credit": [{"artist": {"id": "other-artist-id"}}],
+         "relations": [{"target-type": "work", "work": {"id": "work-id"}, "attributes": ["cover"]}]}
+WORK = {"id": "work-id", "relations": [{"target-type": "recording", "recording": {"id": "recording-id"},
+                                        "begin": "1975", "attributes": ["live"]},
+                                       {"target-type": "recording", "recording": {"id": "studio-id"}}]}
+RELEASE = {"id": "release-id", "date": "1977-05-01", "status": "Official",
+           "media": [{"tracks": [{"recording": {"id": "recording-id"}}, {"recording": {"id": "cover-id"}}]}]}
+UNDATED_RELEASE = {"id": "undated-id", "date": "", "status": "Bootleg",
+                   "media": [{"tracks": [{"recording": {"id": "recording-id"}}]}]}
+
+
+def dump_lines(*entities):
+    return b''.join(json.dumps(entity).encode() + b'\n' for entity in entities)
+
+
+class DumpIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.directory.name, 'index.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_dump(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def write_archive(self, name, member, data):
+        """Package dump lines the way the MusicBrainz JSON dumps are distributed"""
+        path = os.path.join(self.directory.name, name)
+        with tarfile.open(path, 'w:xz') as archive:
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        return path
+
+    def test_build_and_lookup(self):
+        dumps = [self.write_archive('recording.tar.xz', 'mbdump/recording', dump_lines(RECORDING, COVER)),
+                 self.write_dump('work', dump_lines(WORK)),
+                 self.write_archive('release.tar.xz', 'mbdump/release', dump_lines(RELEASE, UNDATED_RELEASE))]
+        counts = DumpIndex.build(self.index_path, dumps)
+        self.assertEqual({'recording': 2, 'work': 1, 'release': 2}, counts)
+
+        index = DumpIndex(self.index_path)
+        try:
+            recording = index.get_recording('recording-id')
+            self.assertEqual(('artist-id',), recording.artist_ids)
+            self.assertEqual(('work-id',), recording.work_ids)
+            self.assertFalse(recording.is_cover)
+            self.assertCountEqual([ReleaseRecord('1977-05-01', 'Official', 'release-id'),
+                                   ReleaseRecord(None, 'Bootleg', 'undated-id')],
+                                  recording.releases)
+            self.assertTrue(index.get_recording('cover-id').is_cover)
+            self.assertIsNone(index.get_recording('missing-id'))
+
+            # Relations come from both the recording and the work dumps
+            work = index.get_work('work-id')
+            relations = {relation.id: relation for relation in work.recordings}
+            self.assertCountEqual(['recording-id', 'cover-id', 'studio-id'], relations)
+            self.assertEqual('1975', relations['recording-id'].begin)
+            self.assertEqual(('live',), relations['recording-id'].attributes)
+            self.assertEqual(('cover',), relations['cover-id'].attributes)
+            self.assertIsNone(index.get_work('missing-id'))
+        finally:
+            index.close()
+
+    def test_counts_add_up_across_files(self):
+        dumps = [self.write_dump('recording', dump_lines(RECORDING)),
+                 self.write_dump('recording.2', dump_lines(COVER)),
+                 self.write_dump('work', dump_lines(WORK))]
+        progress = []
+        counts = DumpIndex.build(self.index_path, dumps, lambda entity_type, count: progress.append(count))
+        self.assertEqual({'recording': 2, 'work': 1, 'release': 0}, counts)
+        self.assertEqual([1, 2, 1], progress)
+
+    def test_rebuild_replaces_index(self):
+        DumpIndex.build(self.index_path, [self.write_dump('recording', dump_lines(RECORDING))])
+        DumpIndex.build(self.index_path, [self.write_dump('recording.json', dump_lines(COVER))])
+        index = DumpIndex(self.index_path)
+        try:
+            self.assertIsNone(index.get_recording('recording-id'))
+            self.assertIsNotNone(index.get_recording('cover-id'))
+        finally:
+            index.close()
+        self.assertFalse(os.path.exists(self.index_path + '.tmp'))
+
+    def test_unknown_dump(self):
+        with self.assertRaises(ValueError):
+            list(iterate_dump(self.write_dump('artist', dump_lines({"id": "artist-id"}))))
+
+    def test_missing_index(self):
+        with self.assertRaises(FileNotFoundError):
+            DumpIndex(self.index_path)
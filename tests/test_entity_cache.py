@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from beetsplug.entity_cache import EntityCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class EntityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = EntityCache(':memory:', ttl=100, negative_ttl=10, clock=self.clock)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_missing(self):
+        with self.assertRaises(KeyError):
+            self.cache.get('recording', 'missing')
+
+    def test_put_and_get(self):
+        recording = {"id": "recording-id", "release-list": [{"date": "1977"}]}
+        self.cache.put('recording', 'recording-id', recording)
+        self.assertEqual(recording, self.cache.get('recording', 'recording-id'))
+        # Kinds are separate
+        with self.assertRaises(KeyError):
+            self.cache.get('work', 'recording-id')
+
+    def test_not_found_is_cached(self):
+        self.cache.put('recording', 'deleted-id', {}, negative=True)
+        self.assertEqual({}, self.cache.get('recording', 'deleted-id'))
+
+    def test_entries_expire(self):
+        self.cache.put('work', 'work-id', {"id": "work-id"})
+        self.clock.now += 99
+        self.assertEqual({"id": "work-id"}, self.cache.get('work', 'work-id'))
+        self.clock.now += 1
+        with self.assertRaises(KeyError):
+            self.cache.get('work', 'work-id')
+
+    def test_negative_entries_expire_sooner(self):
+        self.cache.put('work', 'positive', {"id": "positive"})
+        self.cache.put('work', 'negative', {}, negative=True)
+        self.clock.now += 10
+        self.assertEqual({"id": "positive"}, self.cache.get('work', 'positive'))
+        with self.assertRaises(KeyError):
+            self.cache.get('work', 'negative')
+
+    def test_zero_ttl_disables_caching(self):
+        cache = EntityCache(':memory:', ttl=100, negative_ttl=0, clock=self.clock)
+        cache.put('work', 'negative', {}, negative=True)
+        with self.assertRaises(KeyError):
+            cache.get('work', 'negative')
+        cache.close()
+
+    def test_delete(self):
+        self.cache.put('work', 'work-id', {"id": "work-id"})
+        self.cache.put('recording', 'work-id', {"id": "work-id"})
+        self.cache.delete('work', ['work-id', 'missing'])
+        with self.assertRaises(KeyError):
+            self.cache.get('work', 'work-id')
+        self.assertEqual({"id": "work-id"}, self.cache.get('recording', 'work-id'))
+
+    def test_links(self):
+        self.cache.link('recording_work', [('recording-id', 'work-id'), ('other-id', 'work-id')])
+        self.cache.link('recording_work', [('recording-id', 'work-id'), ('recording-id', 'other-work-id')])
+        self.cache.link('release_recording', [('release-id', 'recording-id')])
+        self.assertEqual({'work-id', 'other-work-id'}, self.cache.linked_from('recording_work', ['recording-id']))
+        self.assertEqual({'recording-id', 'other-id'}, self.cache.linked_to('recording_work', ['work-id', 'missing']))
+        self.assertEqual(set(), self.cache.linked_from('recording_work', ['release-id']))
+        # Links don't expire with the entities
+        self.clock.now += 1000
+        self.assertEqual({'recording-id'}, self.cache.linked_from('release_recording', ['release-id']))
+
+    def test_many_links(self):
+        self.cache.link('release_recording', (('release-id', str(i)) for i in range(2000)))
+        self.assertEqual(2000, len(self.cache.linked_from('release_recording', ['release-id'])))
+        self.assertEqual({'release-id'}, self.cache.linked_to('release_recording', map(str, range(2000))))
+
+    def test_persists_between_runs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'cache.db')
+            cache = EntityCache(path, ttl=100, negative_ttl=10, clock=self.clock)
+            cache.put('recording', 'recording-id', {"id": "recording-id"})
+            cache.close()
+
+            cache = EntityCache(path, ttl=100, negative_ttl=10, clock=self.clock)
+            self.assertEqual({"id": "recording-id"}, cache.get('recording', 'recording-id'))
+            cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import musicbrainzngs
+
+from beetsplug.json_transport import JsonTransport
+from beetsplug.mirror_pool import Mirror
+
+RECORDING = {
+    "id": "recording-id", "title": "Title", "length": 245000,
+    "artist-credit": [{"name": "Artist", "joinphrase": "", "artist": {"id": "artist-id", "name": "Artist"}}],
+    "releases": [{"id": "release-id", "title": "Album", "date": "1977", "status": "Official",
+                  "release-events": [{"date": "1977", "area": {"name": "United Kingdom"}}]}],
+    "relations": [{"type": "performance", "target-type": "work", "attributes": ["cover"],
+                   "work": {"id": "work-id", "title": "Work", "languages": ["eng"]}}],
+}
+
+
+class FakeMusicBrainzHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers['User-Agent']))
+        if self.path.startswith('/ws/2/recording/recording-id?'):
+            self.reply(200, json.dumps(RECORDING).encode())
+        elif self.path.startswith('/ws/2/recording/invalid?'):
+            self.reply(200, b'<html>')
+        elif self.path.startswith('/ws/2/recording/broken?'):
+            self.reply(503, b'{"error": "Rate limited"}')
+        else:
+            self.reply(404, b'{"error": "Not Found"}')
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JsonTransportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMusicBrainzHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.mirror = Mirror('127.0.0.1:{0}'.format(cls.server.server_address[1]))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeMusicBrainzHandler.requests = []
+        self.transport = JsonTransport("test/1.0", timeout=5, pool_size=1)
+
+    def tearDown(self):
+        self.transport.pool.close()
+
+    def test_path(self):
+        path = self.transport.path('recording', 'recording-id', ['artists', 'releases', 'work-rels'])
+        self.assertEqual("/ws/2/recording/recording-id?inc=artists+releases+work-rels&fmt=json", path)
+
+    def test_get_keeps_only_used_fields(self):
+        result = self.transport.get(self.mirror, 'recording', 'recording-id', ['releases'])
+        self.assertEqual({
+            "id": "recording-id",
+            "artist-credit": [{"artist": {"id": "artist-id"}}],
+            "releases": [{"id": "release-id", "date": "1977", "status": "Official"}],
+            "relations": [{"target-type": "work", "attributes": ["cover"], "work": {"id": "work-id"}}],
+        }, result)
+        self.assertEqual([("/ws/2/recording/recording-id?inc=releases&fmt=json", "test/1.0")],
+                         FakeMusicBrainzHandler.requests)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.transport.get(self.mirror, 'recording', 'recording-id', [])
+        # Error responses don't prevent reuse either
+        with self.assertRaises(musicbrainzngs.ResponseError):
+            self.transport.get(self.mirror, 'recording', 'deleted-id', [])
+        self.assertEqual(1, self.transport.pool.opened)
+        self.assertEqual(3, self.transport.pool.reused)
+
+    def test_stale_connection_is_replaced(self):
+        self.transport.get(self.mirror, 'recording', 'recording-id', [])
+        # Simulate the server closing the idle connection
+        for connections in self.transport.pool._idle.values():
+            for connection in connections:
+                connection.sock.close()
+        self.assertEqual("recording-id", self.transport.get(self.mirror, 'recording', 'recording-id', [])["id"])
+        self.assertEqual(2, self.transport.pool.opened)
+
+    def test_not_found_raises_response_error(self):
+        with self.assertRaises(musicbrainzngs.ResponseError) as context:
+            self.transport.get(self.mirror, 'recording', 'deleted-id', [])
+        self.assertEqual(404, context.exception.cause.code)
+
+    def test_server_error_raises_network_error(self):
+        with self.assertRaises(musicbrainzngs.NetworkError):
+            self.transport.get(self.mirror, 'recording', 'broken', [])
+
+    def test_connection_error_raises_network_error(self):
+        # Nothing listens on the port of a closed server
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMusicBrainzHandler)
+        server.server_close()
+        with self.assertRaises(musicbrainzngs.NetworkError):
+            self.transport.get(Mirror('127.0.0.1:{0}'.format(server.server_address[1])), 'recording', 'id', [])
+
+    def test_invalid_json_raises_response_error(self):
+        with self.assertRaises(musicbrainzngs.ResponseError):
+            self.transport.get(self.mirror, 'recording', 'invalid', [])
+
+
+if __name__ == '__main__':
+    unittest.main()
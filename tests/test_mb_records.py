@@ -0,0 +1,111 @@
+import unittest
+
+from beetsplug.mb_records import RecordingRecord, RecordingRelation, ReleaseRecord, WorkRecord
+
+
+class MbRecordsTest(unittest.TestCase):
+    def setUp(self):
+        # Shaped like the output of musicbrainzngs.get_recording_by_id
+        self.recording = {
+            "id": "recording-id",
+            "title": "Title",
+            "artist-credit": [{"artist": {"id": "first-artist", "name": "First"}}, " & ",
+                              {"artist": {"id": "second-artist", "name": "Second"}}],
+            "artist-credit-phrase": "First & Second",
+            "release-list": [{"id": "release-id", "title": "Album", "status": "Official", "date": "1977-05",
+                              "country": "GB", "release-event-list": [{"date": "1977-05"}]},
+                             {"id": "other-release-id", "title": "Bootleg"}],
+            "work-relation-list": [{"type": "performance", "attribute-list": ["cover"],
+                                    "work": {"id": "work-id", "title": "Work"}}],
+        }
+        self.work = {
+            "id": "work-id",
+            "title": "Work",
+            "recording-relation-list": [
+                {"type": "performance", "begin": "1976", "attribute-list": ["live"],
+                 "recording": {"id": "recording-id", "title": "Title"}},
+                {"type": "performance", "recording": {"id": "other-recording-id", "title": "Title"}},
+                {"type": "performance", "recording": {"title": "No id"}},
+            ],
+        }
+
+    def test_recording_from_mb(self):
+        record = RecordingRecord.from_mb(self.recording)
+        self.assertEqual("recording-id", record.id)
+        self.assertEqual(("first-artist", "second-artist"), record.artist_ids)
+        self.assertEqual(("work-id",), record.work_ids)
+        self.assertTrue(record.is_cover)
+        self.assertEqual((ReleaseRecord("1977-05", "Official", "release-id"),
+                          ReleaseRecord(None, None, "other-release-id")), record.releases)
+
+    def test_recording_without_relations(self):
+        record = RecordingRecord.from_mb({"id": "recording-id"})
+        self.assertEqual((), record.artist_ids)
+        self.assertEqual((), record.work_ids)
+        self.assertFalse(record.is_cover)
+        self.assertEqual((), record.releases)
+
+    def test_recording_json_round_trip(self):
+        record = RecordingRecord.from_mb(self.recording)
+        loaded = RecordingRecord.from_json(record.to_json())
+        self.assertEqual((record.id, record.artist_ids, record.work_ids, record.is_cover, record.releases),
+                         (loaded.id, loaded.artist_ids, loaded.work_ids, loaded.is_cover, loaded.releases))
+        self.assertIsNone(RecordingRecord.from_json(None))
+
+    def test_recording_from_json_without_release_ids(self):
+        loaded = RecordingRecord.from_json(["recording-id", [], [], False, [["1977", "Official"]]])
+        self.assertEqual((ReleaseRecord("1977", "Official"),), loaded.releases)
+
+    def test_work_from_mb(self):
+        record = WorkRecord.from_mb(self.work)
+        self.assertEqual("work-id", record.id)
+        self.assertEqual(["recording-id", "other-recording-id"], [relation.id for relation in record.recordings])
+        self.assertEqual("1976", record.recordings[0].begin)
+        self.assertEqual(("live",), record.recordings[0].attributes)
+        self.assertIsNone(record.recordings[1].begin)
+        self.assertEqual((), record.recordings[1].attributes)
+
+    def test_work_json_round_trip(self):
+        record = WorkRecord.from_mb(self.work)
+        loaded = WorkRecord.from_json(record.to_json())
+        self.assertEqual(record.id, loaded.id)
+        self.assertEqual([(r.id, r.begin, r.attributes) for r in record.recordings],
+                         [(r.id, r.begin, r.attributes) for r in loaded.recordings])
+        self.assertIsNone(WorkRecord.from_json(None))
+
+    def test_recording_from_ws_json(self):
+        record = RecordingRecord.from_ws_json({
+            "id": "recording-id",
+            "artist-credit": [{"artist": {"id": "first-artist"}}, {"artist": {"id": "second-artist"}}],
+            "releases": [{"id": "release-id", "date": "1977-05", "status": "Official"}, {"date": "", "status": None}],
+            "relations": [{"target-type": "url", "url": {"id": "url-id"}},
+                          {"target-type": "work", "attributes": ["cover"], "work": {"id": "work-id"}}],
+        })
+        self.assertEqual("recording-id", record.id)
+        self.assertEqual(("first-artist", "second-artist"), record.artist_ids)
+        self.assertEqual(("work-id",), record.work_ids)
+        self.assertTrue(record.is_cover)
+        self.assertEqual((ReleaseRecord("1977-05", "Official", "release-id"), ReleaseRecord(None, None)),
+                         record.releases)
+
+    def test_work_from_ws_json(self):
+        record = WorkRecord.from_ws_json({
+            "id": "work-id",
+            "relations": [
+                {"target-type": "recording", "begin": "1976", "attributes": ["live"],
+                 "recording": {"id": "recording-id"}},
+                {"target-type": "recording", "begin": None, "attributes": [], "recording": {"id": "other-id"}},
+                {"target-type": "artist", "artist": {"id": "artist-id"}},
+            ],
+        })
+        self.assertEqual("work-id", record.id)
+        self.assertEqual([("recording-id", "1976", ("live",)), ("other-id", None, ())],
+                         [(r.id, r.begin, r.attributes) for r in record.recordings])
+
+    def test_records_use_slots(self):
+        for record in (RecordingRecord("id"), RecordingRelation("id"), WorkRecord("id"), ReleaseRecord(None, None)):
+            self.assertFalse(hasattr(record, '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+
+from beetsplug.mirror_pool import Mirror, MirrorPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class MirrorPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def create_pool(self, *mirrors):
+        return MirrorPool(list(mirrors), cooldown=30, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_requests_distributed_across_mirrors(self):
+        first, second = Mirror("first"), Mirror("second")
+        pool = self.create_pool(first, second)
+        acquired = [pool.acquire() for _ in range(4)]
+        self.assertEqual([first, second, first, second], acquired)
+        # Two mirrors at one request per second each allow four requests in just over a second
+        self.assertEqual(101.0, self.clock.now)
+
+    def test_rate_limit_per_mirror(self):
+        mirror = Mirror("host", rate_limit=2, interval=1.0)
+        pool = self.create_pool(mirror)
+        for _ in range(3):
+            pool.acquire()
+        self.assertEqual(101.0, self.clock.now)
+
+    def test_failed_mirror_taken_out_of_rotation(self):
+        first, second = Mirror("first"), Mirror("second")
+        pool = self.create_pool(first, second)
+        pool.report_failure(first)
+        self.assertFalse(pool.is_healthy(first))
+        self.assertEqual(second, pool.acquire())
+        self.assertEqual(second, pool.acquire())
+
+        # Back in rotation once the cooldown expires
+        self.clock.now += 30
+        self.assertTrue(pool.is_healthy(first))
+        self.assertEqual(first, pool.acquire())
+
+    def test_cooldown_grows_with_consecutive_failures(self):
+        mirror = Mirror("host")
+        pool = self.create_pool(mirror)
+        pool.report_failure(mirror)
+        pool.report_failure(mirror)
+        self.assertEqual(160.0, mirror.down_until)
+        pool.report_success(mirror)
+        self.assertTrue(pool.is_healthy(mirror))
+        self.assertEqual(0, mirror.failures)
+
+    def test_all_mirrors_down_uses_first_to_recover(self):
+        first, second = Mirror("first"), Mirror("second")
+        pool = self.create_pool(first, second)
+        pool.report_failure(first)
+        self.clock.now += 1
+        pool.report_failure(second)
+        self.assertFalse(pool.has_healthy())
+        self.assertEqual(first, pool.acquire())
+
+    def test_concurrent_requests_get_separate_slots(self):
+        mirror = Mirror("host")
+        waits = []
+        pool = MirrorPool([mirror], clock=self.clock, sleep=waits.append)
+        # The clock does not move, as if the threads were all waiting at once
+        for _ in range(3):
+            pool.acquire()
+        self.assertEqual([1.0, 2.0], waits)
+        self.assertEqual(103.0, mirror.next_request)
+
+    def test_acquire_from_threads(self):
+        mirror = Mirror("host", rate_limit=1, interval=0.01)
+        pool = MirrorPool([mirror])
+        threads = [threading.Thread(target=pool.acquire) for _ in range(8)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.monotonic() - start, 0.07)
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(ValueError):
+            MirrorPool([])
+        with self.assertRaises(ValueError):
+            Mirror("host", rate_limit=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,29 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 from unittest.mock import patch
 
-from beets.library import Item
+import musicbrainzngs
+from beets.library import Item, Library, parse_query_parts
+from beets.ui import UserError
 
 from beetsplug import oldestdate
 from beetsplug.date_wrapper import DateWrapper
+from beetsplug.mb_records import RecordingRecord, RecordingRelation, ReleaseRecord, WorkRecord
 
 
 class OldestDatePluginTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.oldestdateplugin = oldestdate.OldestDatePlugin()
+        cls.oldestdateplugin.config['cache'] = False  # Don't touch the user's cache file
 
     def setUp(self):
         self.recording_id = 20
@@ -19,11 +31,22 @@ class OldestDatePluginTest(unittest.TestCase):
         self.recordings = [self.recording]
         self.is_cover = False
         self.approach = "recordings"
+        self.oldestdateplugin._reset_budget()
+
+    def relations(self, recordings):
+        """Project test recordings into the recording relations of a work"""
+        return [RecordingRelation.from_mb(rec) for rec in recordings]
+
+    def cache_recordings(self, recordings):
+        """Put recordings into cache to avoid calling the API"""
+        for rec in recordings:
+            recording_id = rec["recording"]["id"]
+            self.oldestdateplugin._recordings_cache[recording_id] = RecordingRecord.from_mb(dict(rec, id=recording_id))
 
     # Test recordings approach
 
     def test_get_work_id_from_recording(self):
-        test_recording = {"work-relation-list": [{"work": {"id": 20}}]}
+        test_recording = RecordingRecord.from_mb({"work-relation-list": [{"work": {"id": 20}}]})
         result = self.oldestdateplugin._get_work_id_from_recording(test_recording)
         self.assertEqual(20, result)
 
@@ -31,16 +54,16 @@ class OldestDatePluginTest(unittest.TestCase):
         recordings = [{"recording": {"id": 20}, "begin": "2020-12-12"}]
         starting_date = DateWrapper(iso_string="20221010")
         expected_date = DateWrapper(iso_string="20201212")
-        result = self.oldestdateplugin._extract_oldest_recording_date(recordings, starting_date, self.is_cover,
-                                                                      self.approach)
+        result = self.oldestdateplugin._extract_oldest_recording_date(self.relations(recordings), starting_date,
+                                                                      self.is_cover, self.approach)
         self.assertEqual(expected_date, result)
 
     def test_extract_oldest_recording_date_with_only_year(self):
         recordings = [{"recording": {"id": 20}, "begin": "1978"}]
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1978)
-        result = self.oldestdateplugin._extract_oldest_recording_date(recordings, starting_date, self.is_cover,
-                                                                      self.approach)
+        result = self.oldestdateplugin._extract_oldest_recording_date(self.relations(recordings), starting_date,
+                                                                      self.is_cover, self.approach)
         self.assertEqual(expected_date, result)
 
     def test_extract_oldest_recording_date_cover(self):
@@ -48,7 +71,8 @@ class OldestDatePluginTest(unittest.TestCase):
                       {"recording": {"id": 20}, "begin": "1976"}]  # non-cover should be filtered out
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1978)
-        result = self.oldestdateplugin._extract_oldest_recording_date(recordings, starting_date, True, self.approach)
+        result = self.oldestdateplugin._extract_oldest_recording_date(self.relations(recordings), starting_date,
+                                                                      True, self.approach)
         self.assertEqual(expected_date, result)
 
     def test_extract_oldest_recording_date_non_cover(self):
@@ -57,7 +81,8 @@ class OldestDatePluginTest(unittest.TestCase):
                       {"recording": {"id": 20}, "begin": "1978"}]
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1978)
-        result = self.oldestdateplugin._extract_oldest_recording_date(recordings, starting_date, False, self.approach)
+        result = self.oldestdateplugin._extract_oldest_recording_date(self.relations(recordings), starting_date,
+                                                                      False, self.approach)
         self.assertEqual(expected_date, result)
 
     # Test releases approach
@@ -65,10 +90,9 @@ class OldestDatePluginTest(unittest.TestCase):
     def test_extract_oldest_release_date(self):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1977)
-        # Put recording into cache to avoid calling the API
-        self.oldestdateplugin._recordings_cache[self.recording_id] = self.recording
-        result = self.oldestdateplugin._extract_oldest_release_date([self.recording], starting_date, self.is_cover,
-                                                                    "releases")
+        self.cache_recordings([self.recording])
+        result = self.oldestdateplugin._extract_oldest_release_date(self.relations([self.recording]), starting_date,
+                                                                    self.is_cover, "releases")
         self.assertEqual(expected_date, result)
 
     def test_extract_oldest_release_date_cover(self):
@@ -80,11 +104,10 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1977)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._extract_oldest_release_date(recordings, starting_date, True, ["artist-id"])
+        result = self.oldestdateplugin._extract_oldest_release_date(self.relations(recordings), starting_date,
+                                                                    True, ["artist-id"])
         self.assertEqual(expected_date, result)
 
     def test_extract_oldest_release_date_non_cover(self):
@@ -98,11 +121,10 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1976)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._extract_oldest_release_date(recordings, starting_date, False, ["artist-id"])
+        result = self.oldestdateplugin._extract_oldest_release_date(self.relations(recordings), starting_date,
+                                                                    False, ["artist-id"])
         self.assertEqual(expected_date, result)
 
     def test_extract_oldest_release_date_filter_recordings(self):
@@ -117,11 +139,10 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1976)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._extract_oldest_release_date(recordings, starting_date, False, ["artist-id"])
+        result = self.oldestdateplugin._extract_oldest_release_date(self.relations(recordings), starting_date,
+                                                                    False, ["artist-id"])
         self.assertEqual(expected_date, result)
         self.oldestdateplugin.config['filter_recordings'] = False
 
@@ -138,11 +159,10 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1977)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._extract_oldest_release_date(recordings, starting_date, False, ["artist-id"])
+        result = self.oldestdateplugin._extract_oldest_release_date(self.relations(recordings), starting_date,
+                                                                    False, ["artist-id"])
         self.assertEqual(expected_date, result)
         self.oldestdateplugin.config['release_types'] = None
 
@@ -159,11 +179,9 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1978)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._iterate_dates(recordings, starting_date, False, [])
+        result = self.oldestdateplugin._iterate_dates(self.relations(recordings), starting_date, False, [])
         self.assertEqual(expected_date, result)
         self.oldestdateplugin.config['approach'] = "releases"
 
@@ -180,11 +198,9 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1975)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._iterate_dates(recordings, starting_date, False, [])
+        result = self.oldestdateplugin._iterate_dates(self.relations(recordings), starting_date, False, [])
         self.assertEqual(expected_date, result)
 
     def test_iterate_dates_hybrid_found(self):
@@ -200,11 +216,9 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1978)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._iterate_dates(recordings, starting_date, False, [])
+        result = self.oldestdateplugin._iterate_dates(self.relations(recordings), starting_date, False, [])
         self.assertEqual(expected_date, result)
         self.oldestdateplugin.config['approach'] = "releases"
 
@@ -221,11 +235,9 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1975)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._iterate_dates(recordings, starting_date, False, [])
+        result = self.oldestdateplugin._iterate_dates(self.relations(recordings), starting_date, False, [])
         self.assertEqual(expected_date, result)
         self.oldestdateplugin.config['approach'] = "releases"
 
@@ -242,11 +254,9 @@ class OldestDatePluginTest(unittest.TestCase):
         starting_date = DateWrapper(2022, 10, 10)
         expected_date = DateWrapper(1974)
 
-        # Put recordings into cache to avoid calling the API
-        for i in range(len(recordings)):
-            self.oldestdateplugin._recordings_cache[self.recording_id + i] = recordings[i]
+        self.cache_recordings(recordings)
 
-        result = self.oldestdateplugin._iterate_dates(recordings, starting_date, False, [])
+        result = self.oldestdateplugin._iterate_dates(self.relations(recordings), starting_date, False, [])
         self.assertEqual(expected_date, result)
         self.oldestdateplugin.config['approach'] = "releases"
 
@@ -304,6 +314,642 @@ class OldestDatePluginTest(unittest.TestCase):
             'Skipping track with no mb_trackid: {0.artist} - {0.title}', item
         )
 
+    # Test two-phase export and apply
+
+    def test_export_and_apply_results(self):
+        self.oldestdateplugin.config['force'] = True
+        lib = Library(':memory:')
+        item = Item(mb_trackid="recording-id", data_source="MusicBrainz", artist="Test Artist", title="Test Title")
+        lib.add(item)
+        self.oldestdateplugin._recordings_cache["recording-id"] = RecordingRecord("recording-id", work_ids=("work-id",))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'results.jsonl')
+            with patch.object(self.oldestdateplugin, '_get_oldest_date', return_value=DateWrapper(1970, 5)):
+                self.oldestdateplugin._export_results(lib.items(), path)
+
+            # Exporting must not touch the library
+            self.assertNotIn('recording_year', lib.get_item(item.id))
+            with open(path) as results_file:
+                result = json.loads(results_file.readline())
+            self.assertEqual({"id": item.id, "recording_id": "recording-id", "work_id": "work-id", "year": 1970,
+                              "month": 5, "day": None, "source": "releases", "approximate": False},
+                             result)
+
+            self.oldestdateplugin._apply_results(lib, path, [])
+
+        applied = lib.get_item(item.id)
+        self.assertEqual('1970', applied.recording_year)
+        self.assertEqual('5', applied.recording_month)
+        self.assertNotIn('recording_day', applied)
+        self.oldestdateplugin.config['force'] = False
+
+    def test_apply_results_skips_changed_recording(self):
+        lib = Library(':memory:')
+        item = Item(mb_trackid="new-recording-id", data_source="MusicBrainz")
+        lib.add(item)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'results.jsonl')
+            with open(path, 'w') as results_file:
+                results_file.write(json.dumps({"id": item.id, "recording_id": "old-recording-id", "work_id": None,
+                                               "year": 1970, "month": None, "day": None, "source": "releases"}))
+            self.oldestdateplugin._apply_results(lib, path, [])
+
+        self.assertNotIn('recording_year', lib.get_item(item.id))
+
+    # Test sharding
+
+    def test_parse_shard(self):
+        self.assertEqual((0, 4), self.oldestdateplugin._parse_shard("1/4"))
+        self.assertEqual((3, 4), self.oldestdateplugin._parse_shard("4/4"))
+        for spec in ("0/4", "5/4", "1/0", "1", "a/b"):
+            with self.assertRaises(UserError):
+                self.oldestdateplugin._parse_shard(spec)
+
+    def test_get_shard_groups_by_work(self):
+        first = Item(mb_trackid="first-recording", mb_workid="work-id")
+        second = Item(mb_trackid="second-recording", mb_workid="work-id")
+        shards = {self.oldestdateplugin._get_shard(item, 16) for item in (first, second)}
+        self.assertEqual(1, len(shards))
+
+        # Without a work id, fall back to the recording id
+        no_work = Item(mb_trackid="first-recording")
+        self.assertEqual(self.oldestdateplugin._get_shard(no_work, 16),
+                         self.oldestdateplugin._get_shard(Item(mb_trackid="first-recording"), 16))
+        self.assertTrue(0 <= self.oldestdateplugin._get_shard(no_work, 16) < 16)
+
+    # Test mirror failover
+
+    def test_retry_fails_over_to_next_mirror(self):
+        original_pool = self.oldestdateplugin._mirror_pool
+        self.oldestdateplugin._mirror_pool = oldestdate.MirrorPool(
+            [oldestdate.Mirror("dead", interval=0), oldestdate.Mirror("alive", interval=0)])
+        hosts = []
+
+        def fetch(mirror):
+            hosts.append(mirror.host)
+            if hosts[-1] == "dead":
+                raise musicbrainzngs.NetworkError()
+            return "result"
+
+        try:
+            with patch('time.sleep') as mock_sleep:
+                self.assertEqual("result", self.oldestdateplugin._retry_on_network_error(fetch))
+                mock_sleep.assert_not_called()
+            self.assertEqual(["dead", "alive"], hosts)
+        finally:
+            self.oldestdateplugin._mirror_pool = original_pool
+
+    def test_on_mirror_keeps_host_until_request_is_made(self):
+        seen = {}
+
+        def fetch(expected):
+            seen[expected] = musicbrainzngs.musicbrainz.hostname
+            time.sleep(0.01)  # Give the other thread a chance to switch the host
+            seen[expected] = seen[expected] if seen[expected] == musicbrainzngs.musicbrainz.hostname else None
+
+        original = musicbrainzngs.musicbrainz.hostname, musicbrainzngs.musicbrainz.https
+        try:
+            call = self.oldestdateplugin._on_mirror(fetch)
+            threads = [threading.Thread(target=call, args=(oldestdate.Mirror(host), host))
+                       for host in ("first", "second")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            musicbrainzngs.set_hostname(*original)
+        self.assertEqual({"first": "first", "second": "second"}, seen)
+
+    # Test request budget and auto approach
+
+    def test_iterate_dates_auto_within_budget(self):
+        self.oldestdateplugin.config['approach'] = "auto"
+        self.oldestdateplugin.config['max_requests_per_item'] = 5
+        recordings = [
+            {"recording": {"id": self.recording_id}, "begin": "1978", "release-list": [{"date": "1976"}]},
+            {"recording": {"id": self.recording_id + 1}, "begin": "1977", "release-list": [{"date": "1979"}]},
+        ]
+        self.cache_recordings(recordings)
+
+        self.oldestdateplugin._reset_budget()
+        result = self.oldestdateplugin._iterate_dates(self.relations(recordings), DateWrapper(2022, 10, 10), False, [])
+        self.assertEqual(DateWrapper(1976), result)
+        self.assertFalse(self.oldestdateplugin._budget.approximate)
+        self.assertEqual("both", self.oldestdateplugin._budget.approach)
+        self.oldestdateplugin.config['approach'] = "releases"
+        self.oldestdateplugin.config['max_requests_per_item'] = None
+
+    def test_iterate_dates_auto_over_budget(self):
+        self.oldestdateplugin.config['approach'] = "auto"
+        self.oldestdateplugin.config['max_requests_per_item'] = 1
+        recordings = [
+            {"recording": {"id": self.recording_id}, "begin": "1978", "release-list": [{"date": "1976"}]},
+            {"recording": {"id": self.recording_id + 1}, "begin": "1977", "release-list": [{"date": "1979"}]},
+        ]
+
+        self.oldestdateplugin._reset_budget()
+        with patch.object(self.oldestdateplugin, '_fetch_recording') as mock_fetch:
+            result = self.oldestdateplugin._iterate_dates(self.relations(recordings), DateWrapper(2022, 10, 10),
+                                                          False, [])
+            mock_fetch.assert_not_called()
+        # Only recording dates are used, and the result is marked approximate
+        self.assertEqual(DateWrapper(1977), result)
+        self.assertTrue(self.oldestdateplugin._budget.approximate)
+        self.assertEqual("recordings", self.oldestdateplugin._budget.approach)
+        self.oldestdateplugin.config['approach'] = "releases"
+        self.oldestdateplugin.config['max_requests_per_item'] = None
+
+    def test_result_reports_approach_chosen_by_auto(self):
+        self.oldestdateplugin.config['approach'] = "auto"
+        item = Item(mb_trackid="auto-id", data_source="MusicBrainz")
+
+        def find_oldest_date(recording_id, item_date):
+            return self.oldestdateplugin._iterate_dates([RecordingRelation("auto-id", "1975")],
+                                                        DateWrapper(2022, 10, 10), False, [])
+
+        try:
+            with patch.object(self.oldestdateplugin, '_get_recording', return_value=None), \
+                    patch.object(self.oldestdateplugin, '_find_oldest_date', side_effect=find_oldest_date), \
+                    patch.object(self.oldestdateplugin, '_can_afford', return_value=False):
+                result = self.oldestdateplugin._compute_result(item)
+        finally:
+            self.oldestdateplugin.config['approach'] = "releases"
+        self.assertEqual((1975, "recordings", True), (result['year'], result['source'], result['approximate']))
+
+    def test_iterate_dates_auto_cached_work_within_budget(self):
+        self.oldestdateplugin.config['approach'] = "auto"
+        self.oldestdateplugin.config['max_requests_per_item'] = 2
+        recordings = [{"recording": {"id": self.recording_id + offset}, "begin": "1978",
+                       "release-list": [{"date": str(1970 + offset)}]} for offset in range(5)]
+        self.cache_recordings(recordings)
+
+        self.oldestdateplugin._reset_budget()
+        with patch.object(self.oldestdateplugin, '_fetch_recording') as mock_fetch:
+            result = self.oldestdateplugin._iterate_dates(self.relations(recordings), DateWrapper(2022, 10, 10),
+                                                          False, [])
+            mock_fetch.assert_not_called()
+        # Cached recordings don't count against the budget
+        self.assertEqual(DateWrapper(1970), result)
+        self.assertFalse(self.oldestdateplugin._budget.approximate)
+        self.oldestdateplugin.config['approach'] = "releases"
+        self.oldestdateplugin.config['max_requests_per_item'] = None
+
+    def test_extract_oldest_release_date_stops_when_budget_exhausted(self):
+        self.oldestdateplugin.config['max_requests_per_item'] = 1
+        recordings = [
+            {"recording": {"id": self.recording_id}, "begin": "1978", "release-list": [{"date": "1976"}]},
+            {"recording": {"id": self.recording_id + 1}, "begin": "1978", "release-list": [{"date": "1970"}]},
+        ]
+
+        def fetch(recording_id):
+            self.oldestdateplugin._budget.requests += 1
+            return RecordingRecord.from_mb(dict(recordings[recording_id - self.recording_id], id=recording_id))
+
+        self.oldestdateplugin._reset_budget()
+        with patch.object(self.oldestdateplugin, '_fetch_recording', side_effect=fetch) as mock_fetch:
+            result = self.oldestdateplugin._extract_oldest_release_date(self.relations(recordings),
+                                                                        DateWrapper(2022, 10, 10), False, [])
+            mock_fetch.assert_called_once_with(self.recording_id)
+        self.assertEqual(DateWrapper(1976), result)
+        self.assertTrue(self.oldestdateplugin._budget.approximate)
+        self.oldestdateplugin.config['max_requests_per_item'] = None
+
+    def test_extract_oldest_release_date_uses_library_when_budget_exhausted(self):
+        self.oldestdateplugin.config['max_requests_per_item'] = 1
+        self.oldestdateplugin.config['local_releases'] = True
+        lib = Library(':memory:')
+        album = lib.add_album([Item(mb_trackid="local-id", mb_artistid="artist-id", data_source="MusicBrainz")])
+        album.update({'year': 1969, 'month': 7, 'albumstatus': "Official", 'mb_albumid': "album-id"})
+        album.store()
+        lib.add(Item(mb_trackid="local-id", data_source="MusicBrainz"))  # Singletons have no release
+        recordings = [RecordingRelation("fetched-id"), RecordingRelation("local-id"), RecordingRelation("unknown-id")]
+
+        def fetch(recording_id):
+            self.oldestdateplugin._budget.requests += 1
+            return RecordingRecord(recording_id, releases=(ReleaseRecord("1976", "Official"),))
+
+        self.oldestdateplugin._reset_budget()
+        try:
+            with patch.object(self.oldestdateplugin, '_lib', lib), \
+                    patch.object(self.oldestdateplugin, '_fetch_recording', side_effect=fetch) as mock_fetch:
+                result = self.oldestdateplugin._extract_oldest_release_date(recordings, DateWrapper(2022, 10, 10),
+                                                                            False, [])
+                mock_fetch.assert_called_once_with("fetched-id")
+            self.assertEqual(DateWrapper(1969, 7), result)
+            self.assertTrue(self.oldestdateplugin._budget.approximate)
+            local = self.oldestdateplugin._budget.local_recordings["local-id"]
+            self.assertEqual(("artist-id",), local.artist_ids)
+            self.assertEqual((ReleaseRecord("1969-07", "Official", "album-id"),), local.releases)
+        finally:
+            self.oldestdateplugin.config['max_requests_per_item'] = None
+            self.oldestdateplugin.config['local_releases'] = False
+
+    def test_local_releases_without_budget_warns(self):
+        self.oldestdateplugin.config['local_releases'] = True
+        try:
+            with patch.object(self.oldestdateplugin, '_log') as mock_log:
+                self.oldestdateplugin._check_config()
+                mock_log.warning.assert_called_once()
+                mock_log.reset_mock()
+
+                self.oldestdateplugin.config['max_seconds_per_item'] = 60
+                self.oldestdateplugin._check_config()
+                mock_log.warning.assert_not_called()
+        finally:
+            self.oldestdateplugin.config['local_releases'] = False
+            self.oldestdateplugin.config['max_seconds_per_item'] = None
+
+    def test_budget_is_per_thread(self):
+        self.oldestdateplugin._budget.approximate = True
+        # E.g. the missing work prompt resolving another item while this one is being resolved
+        thread = threading.Thread(target=self.oldestdateplugin._reset_budget)
+        thread.start()
+        thread.join()
+        self.assertTrue(self.oldestdateplugin._budget.approximate)
+
+    def test_item_recording_counts_against_budget(self):
+        self.oldestdateplugin.config['max_requests_per_item'] = 5
+        item = Item(mb_trackid="budget-id", data_source="MusicBrainz")
+        self.oldestdateplugin._budget.requests = 3  # Left over from the previous item
+
+        def get_oldest_date(recording_id, item_date):
+            self.assertEqual((4, None), self.oldestdateplugin._remaining_budget())
+            return DateWrapper(1970)
+
+        try:
+            with patch.object(self.oldestdateplugin, '_retry_on_network_error',
+                              return_value={"recording": {"id": "budget-id"}}), \
+                    patch.object(self.oldestdateplugin, '_get_oldest_date', side_effect=get_oldest_date):
+                self.assertEqual(1970, self.oldestdateplugin._compute_result(item)['year'])
+        finally:
+            self.oldestdateplugin.config['max_requests_per_item'] = None
+            self.oldestdateplugin._recordings_cache.pop("budget-id", None)
+
+    def test_approximate_date_is_refined(self):
+        item = Item(mb_trackid="some_track_id", data_source="MusicBrainz", recording_year="2022",
+                    recording_date_approximate=1)
+        with patch.object(self.oldestdateplugin, '_get_recording', return_value=None), \
+                patch.object(self.oldestdateplugin, '_get_oldest_date', return_value=DateWrapper(1970)) as mock_get:
+            result = self.oldestdateplugin._compute_result(item)
+            mock_get.assert_called_once()
+        self.assertEqual(1970, result['year'])
+
+        self.oldestdateplugin._apply_date(item, DateWrapper(1970), False)
+        self.assertNotIn('recording_date_approximate', item)
+
+    # Test negative caching
+
+    def test_recording_without_work_not_fetched_again(self):
+        recording = {"id": "no-work-id", "release-list": [{"date": "1977"}]}
+        with patch.object(self.oldestdateplugin, '_retry_on_network_error',
+                          return_value={"recording": recording}) as mock_fetch:
+            self.assertFalse(self.oldestdateplugin._has_work_id("no-work-id"))
+            self.oldestdateplugin._recordings_cache.pop("no-work-id")
+            self.assertFalse(self.oldestdateplugin._has_work_id("no-work-id"))
+            mock_fetch.assert_called_once()
+
+    def test_recording_not_found_is_cached(self):
+        error = musicbrainzngs.ResponseError(cause=mock.Mock(code=404))
+        with patch.object(self.oldestdateplugin, '_retry_on_network_error', side_effect=error) as mock_fetch:
+            self.assertIsNone(self.oldestdateplugin._get_oldest_date("deleted-id", DateWrapper(1990)))
+            self.oldestdateplugin._recordings_cache.pop("deleted-id")
+            self.assertIsNone(self.oldestdateplugin._get_oldest_date("deleted-id", DateWrapper(1990)))
+            mock_fetch.assert_called_once()
+
+    def test_work_without_recordings_not_fetched_again(self):
+        with patch.object(self.oldestdateplugin, '_retry_on_network_error',
+                          return_value={"work": {"id": "empty-work-id"}}) as mock_fetch:
+            self.assertEqual((), self.oldestdateplugin._get_work("empty-work-id").recordings)
+            self.assertEqual((), self.oldestdateplugin._get_work("empty-work-id").recordings)
+            mock_fetch.assert_called_once()
+
+    def test_no_date_is_cached(self):
+        recording = {"id": "undated-id", "work-relation-list": [{"work": {"id": "undated-work-id"}}]}
+        work = {"id": "undated-work-id", "recording-relation-list": [{"recording": {"id": "undated-id"}}]}
+        self.oldestdateplugin._recordings_cache["undated-id"] = RecordingRecord.from_mb(recording)
+        self.oldestdateplugin.config['approach'] = "recordings"
+        with patch.object(self.oldestdateplugin, '_get_work', return_value=WorkRecord.from_mb(work)) as mock_get_work:
+            self.assertIsNone(self.oldestdateplugin._get_oldest_date("undated-id", None))
+            self.assertIsNone(self.oldestdateplugin._get_oldest_date("undated-id", None))
+            mock_get_work.assert_called_once()
+        self.oldestdateplugin.config['approach'] = "releases"
+
+    # Test watch mode
+
+    def add_item(self, lib, added, path=b''):
+        """Add an item as if it had been imported at the given time"""
+        item = Item(mb_trackid="recording-id", data_source="MusicBrainz", path=path)
+        lib.add(item)
+        item.added = added
+        item.store()
+        return item
+
+    def test_process_added_since(self):
+        lib = Library(':memory:')
+        for added in (100.0, 200.0):
+            self.add_item(lib, added)
+
+        query, _ = parse_query_parts([], Item)
+        with patch.object(self.oldestdateplugin, '_process_added_item') as mock_process:
+            self.assertEqual(200.0, self.oldestdateplugin._process_added_since(lib, query, None, None, set()))
+            self.assertEqual(2, mock_process.call_count)
+
+            self.add_item(lib, 300.0)
+            mock_process.reset_mock()
+            self.assertEqual(300.0, self.oldestdateplugin._process_added_since(lib, query, None, 200.0, set()))
+            self.assertEqual([300.0], [call.args[1].added for call in mock_process.call_args_list])
+
+    def test_watch_survives_network_errors(self):
+        lib = Library(':memory:')
+        self.add_item(lib, 100.0)
+        with patch.object(self.oldestdateplugin, '_process_added_item',
+                          side_effect=musicbrainzngs.NetworkError()) as mock_process, \
+                patch.object(oldestdate.time, 'sleep', side_effect=[None, KeyboardInterrupt]) as mock_sleep:
+            self.oldestdateplugin._watch(lib, [], None)
+        mock_process.assert_called_once()
+        self.assertEqual(2, mock_sleep.call_count)
+
+    def test_watch_survives_file_errors(self):
+        lib = Library(':memory:', '/music')
+        for added in (100.0, 200.0):
+            self.add_item(lib, added, b'/music/missing.mp3')
+        query, _ = parse_query_parts([], Item)
+        result = {'year': 1970, 'month': None, 'day': None, 'approximate': False}
+        with patch.object(self.oldestdateplugin, '_compute_result', return_value=result), \
+                patch.object(self.oldestdateplugin, '_log') as mock_log:
+            self.assertEqual(200.0, self.oldestdateplugin._process_added_since(lib, query, None, None, set()))
+        self.assertEqual(2, mock_log.error.call_count)
+        # The date is still stored, and can be written later
+        self.assertEqual(['1970', '1970'], [item.recording_year for item in lib.items()])
+
+    def test_watch_waits_for_files_to_reach_library(self):
+        lib = Library(':memory:', '/music')
+        added = time.time()
+        item = self.add_item(lib, added, b'/downloads/song.mp3')
+        query, _ = parse_query_parts([], Item)
+        pending = set()
+        result = {'year': 1970, 'month': None, 'day': None, 'approximate': False}
+        with patch.object(self.oldestdateplugin, '_compute_result', return_value=result) as mock_compute, \
+                patch.object(Item, 'write') as mock_write:
+            self.oldestdateplugin._process_added_since(lib, query, None, added - 100, pending)
+            mock_compute.assert_not_called()
+            self.assertEqual({item.id}, pending)
+
+            # The import copies the file into the library
+            imported = lib.get_item(item.id)
+            imported.path = b'/music/song.mp3'
+            imported.store()
+            self.oldestdateplugin._process_added_since(lib, query, None, added, pending)
+            mock_compute.assert_called_once()
+            mock_write.assert_called_once()
+            self.assertEqual(set(), pending)
+
+        # Written to the item as it is now, not as it was when first seen
+        stored = lib.get_item(item.id)
+        self.assertEqual('1970', stored.recording_year)
+        self.assertEqual(b'/music/song.mp3', stored.path)
+
+    def test_watch_stops_waiting_for_files_that_stay_outside_library(self):
+        lib = Library(':memory:', '/music')
+        added = time.time() - 600  # E.g. imported with -C, so the file stays where it is
+        item = self.add_item(lib, added, b'/downloads/song.mp3')
+        query, _ = parse_query_parts([], Item)
+        pending = {item.id}
+        result = {'year': 1970, 'month': None, 'day': None, 'approximate': False}
+        with patch.object(self.oldestdateplugin, '_compute_result', return_value=result), \
+                patch.object(Item, 'write') as mock_write, \
+                patch.object(self.oldestdateplugin, '_log') as mock_log:
+            self.oldestdateplugin._process_added_since(lib, query, None, added, pending)
+            mock_write.assert_called_once()
+            mock_log.warning.assert_called_once()
+        self.assertEqual(set(), pending)
+        self.assertEqual('1970', lib.get_item(item.id).recording_year)
+
+    # Test prefetching
+
+    def test_prefetch_fills_cache(self):
+        cache = oldestdate.EntityCache(':memory:', ttl=100, negative_ttl=10)
+        cache.put('recording', "cached-id", RecordingRecord("cached-id", work_ids=("work-id",)).to_json())
+        work = {"id": "work-id", "recording-relation-list": [
+            {"recording": {"id": "item-id"}}, {"recording": {"id": "cached-id"}},
+            {"recording": {"id": "live-id"}, "attribute-list": ["live"]}, {"recording": {"id": "other-id"}}]}
+
+        def fetch(_, entity_id, includes):
+            if 'recording-rels' in includes:
+                return {"work": work}
+            return {"recording": {"id": entity_id, "work-relation-list": [{"work": {"id": "work-id"}}]}}
+
+        lib = Library(':memory:')
+        for recording_id in ("item-id", "cached-id", "item-id"):
+            lib.add(Item(mb_trackid=recording_id, data_source="MusicBrainz"))
+        lib.add(Item(mb_trackid="other-source-id", data_source="Discogs"))
+
+        self.oldestdateplugin.config['cache'] = True
+        self.oldestdateplugin.config['filter_recordings'] = True
+        try:
+            with patch.object(self.oldestdateplugin, '_entity_cache', cache), \
+                    patch.object(self.oldestdateplugin, '_retry_on_network_error', side_effect=fetch) as mock_fetch:
+                self.oldestdateplugin._prefetch(lib.items())
+                fetched = [call.args[1] for call in mock_fetch.call_args_list]
+                self.assertCountEqual(["item-id", "work-id", "other-id"], fetched)
+                self.assertEqual("other-id", cache.get('recording', "other-id")[0])
+                self.assertNotIn("other-id", self.oldestdateplugin._recordings_cache)
+        finally:
+            self.oldestdateplugin.config['cache'] = False
+            self.oldestdateplugin.config['filter_recordings'] = False
+            cache.close()
+
+    def test_prefetch_skips_processed_items_and_errors(self):
+        cache = oldestdate.EntityCache(':memory:', ttl=100, negative_ttl=10)
+
+        def fetch(_, entity_id, includes):
+            if entity_id == "unreachable-id":
+                raise musicbrainzngs.NetworkError()
+            return {"recording": {"id": entity_id}}
+
+        lib = Library(':memory:')
+        lib.add(Item(mb_trackid="processed-id", data_source="MusicBrainz", recording_year=1970))
+        lib.add(Item(mb_trackid="stale-id", data_source="MusicBrainz", recording_year=1970, recording_date_stale=1))
+        lib.add(Item(mb_trackid="unreachable-id", data_source="MusicBrainz"))
+        lib.add(Item(mb_trackid="item-id", data_source="MusicBrainz"))
+
+        self.oldestdateplugin.config['cache'] = True
+        try:
+            with patch.object(self.oldestdateplugin, '_entity_cache', cache), \
+                    patch.object(self.oldestdateplugin, '_retry_on_network_error', side_effect=fetch) as mock_fetch, \
+                    patch.object(self.oldestdateplugin, '_log') as mock_log:
+                self.oldestdateplugin._prefetch(lib.items())
+                fetched = [call.args[1] for call in mock_fetch.call_args_list]
+                self.assertCountEqual(["stale-id", "unreachable-id", "item-id"], fetched)
+                self.assertEqual("item-id", cache.get('recording', "item-id")[0])
+                mock_log.error.assert_called_once()
+        finally:
+            self.oldestdateplugin.config['cache'] = False
+            cache.close()
+
+    def test_prefetch_requires_cache(self):
+        with self.assertRaises(UserError):
+            self.oldestdateplugin._prefetch([])
+
+    # Test invalidation
+
+    def test_invalidate_changed_release(self):
+        clock = mock.Mock(return_value=1000.0)
+        cache = oldestdate.EntityCache(':memory:', ttl=100, negative_ttl=10, clock=clock)
+        recordings = {
+            "on-release-id": {"id": "on-release-id", "release-list": [{"id": "changed-release-id", "date": "1977"}],
+                              "work-relation-list": [{"work": {"id": "changed-work-id"}}]},
+            "unrelated-id": {"id": "unrelated-id", "work-relation-list": [{"work": {"id": "unrelated-work-id"}}]},
+        }
+        work = {"id": "changed-work-id", "recording-relation-list": [
+            {"recording": {"id": "on-release-id"}}, {"recording": {"id": "same-work-id"}}]}
+
+        def fetch(_, entity_id, includes):
+            if 'recording-rels' in includes:
+                return {"work": work}
+            return {"recording": recordings[entity_id]}
+
+        with patch.object(self.oldestdateplugin, '_entity_cache', cache), \
+                patch.object(self.oldestdateplugin, '_retry_on_network_error', side_effect=fetch):
+            for recording_id in recordings:
+                self.oldestdateplugin._fetch_recording(recording_id)
+                self.oldestdateplugin._recordings_cache.pop(recording_id)
+            self.oldestdateplugin._fetch_work("changed-work-id")
+        # The links outlive the cached entities
+        clock.return_value += 100
+        cache.put('recording', "on-release-id", recordings["on-release-id"])
+        cache.put('recording', "same-work-id", RecordingRecord("same-work-id").to_json())
+        cache.put('no_date', "same-work-id", "releases", negative=True)
+
+        lib = Library(':memory:')
+        items = [Item(mb_trackid=recording_id, data_source="MusicBrainz", recording_year=1970)
+                 for recording_id in ("same-work-id", "unrelated-id")]
+        items.append(Item(mb_trackid="on-release-id", data_source="MusicBrainz"))  # Not processed yet
+        for item in items:
+            lib.add(item)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'changes')
+            with open(path, 'w') as changes_file:
+                changes_file.write("# Changed since last packet\nrelease changed-release-id\n")
+            with patch.object(self.oldestdateplugin, '_entity_cache', cache):
+                self.oldestdateplugin._invalidate_command_func(lib, None, [path])
+
+        with self.assertRaises(KeyError):
+            cache.get('recording', "on-release-id")
+        with self.assertRaises(KeyError):
+            cache.get('no_date', "same-work-id")
+        self.assertIsNotNone(cache.get('recording', "same-work-id"))
+        self.assertEqual(["same-work-id"],
+                         [item.mb_trackid for item in lib.items() if item.get('recording_date_stale')])
+
+        # Stale items are resolved again even without force, which clears the flag
+        stale_item = lib.get_item(items[0].id)
+        with patch.object(self.oldestdateplugin, '_entity_cache', cache), \
+                patch.object(self.oldestdateplugin, '_get_oldest_date', return_value=DateWrapper(1960)):
+            result = self.oldestdateplugin._compute_result(stale_item)
+        self.assertEqual(1960, result['year'])
+        self.oldestdateplugin._apply_date(stale_item, DateWrapper(1960))
+        self.assertNotIn('recording_date_stale', stale_item)
+        cache.close()
+
+    def test_read_changed_ids_from_stdin(self):
+        stdin = io.StringIO("recording recording-id\nwork work-id\n")
+        with patch.object(oldestdate.sys, 'stdin', stdin):
+            changed = self.oldestdateplugin._read_changed_ids(['-'])
+        self.assertEqual({'recording': {"recording-id"}, 'work': {"work-id"}, 'release': set()}, changed)
+        self.assertFalse(stdin.closed)
+
+    def test_invalidate_rejects_invalid_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'changes')
+            with open(path, 'w') as changes_file:
+                changes_file.write("artist artist-id\n")
+            with self.assertRaises(UserError):
+                self.oldestdateplugin._invalidate_command_func(Library(':memory:'), None, [path])
+
+    # Test offline mode
+
+    def test_offline_reads_from_index(self):
+        recording = {"id": "offline-id", "artist-credit": [{"artist": {"id": "artist-id"}}],
+                     "relations": [{"target-type": "work", "work": {"id": "offline-work-id"}, "begin": "1975"}]}
+        release = {"id": "release-id", "date": "1973", "status": "Official",
+                   "media": [{"tracks": [{"recording": {"id": "offline-id"}}]}]}
+        with tempfile.TemporaryDirectory() as directory:
+            dumps = []
+            for name, entity in (('recording', recording), ('release', release)):
+                dumps.append(os.path.join(directory, name))
+                with open(dumps[-1], 'w') as file:
+                    file.write(json.dumps(entity) + '\n')
+            index_path = os.path.join(directory, 'index.db')
+            self.oldestdateplugin.config['index_file'] = index_path
+            self.oldestdateplugin._index_command_func(None, None, dumps)
+
+            self.oldestdateplugin.config['offline'] = True
+            self.oldestdateplugin.config['approach'] = "both"
+            try:
+                with patch.object(self.oldestdateplugin, '_retry_on_network_error') as mock_fetch:
+                    self.assertEqual(DateWrapper(1973), self.oldestdateplugin._get_oldest_date("offline-id", None))
+                    mock_fetch.assert_not_called()
+            finally:
+                self.oldestdateplugin._dump_index.close()
+                self.oldestdateplugin._dump_index = None
+                self.oldestdateplugin.config['offline'] = False
+                self.oldestdateplugin.config['approach'] = "releases"
+                self.oldestdateplugin.config['index_file'] = None
+
+    def test_loading_plugin_does_not_import_dump_index(self):
+        # Building and reading the index needs heavy modules, such as tarfile, that every beet command would pay for
+        loaded = subprocess.check_output([sys.executable, '-c', 'import sys; import beetsplug.oldestdate; '
+                                          'print(" ".join(sorted(sys.modules)))']).decode().split()
+        self.assertNotIn('beetsplug.dump_index', loaded)
+        self.assertNotIn('tarfile', loaded)
+
+    def test_index_command_requires_dumps(self):
+        with self.assertRaises(UserError):
+            self.oldestdateplugin._index_command_func(None, None, [])
+
+    def test_force_ignores_entries_from_earlier_runs(self):
+        cache = self.oldestdateplugin._get_entity_cache()
+        cache.put('work', "old-work-id", WorkRecord("old-work-id").to_json())
+        self.oldestdateplugin.config['force'] = True
+        try:
+            with patch.object(self.oldestdateplugin, '_retry_on_network_error',
+                              return_value={"work": {"id": "old-work-id"}}) as mock_fetch:
+                self.oldestdateplugin._get_work("old-work-id")
+                self.oldestdateplugin._get_work("old-work-id")  # Fetched during this run, so cached
+                mock_fetch.assert_called_once()
+        finally:
+            self.oldestdateplugin.config['force'] = False
+
+    def test_no_date_depends_on_settings(self):
+        recording = {"id": "filtered-id", "work-relation-list": [{"work": {"id": "filtered-work-id"}}]}
+        work = {"id": "filtered-work-id", "recording-relation-list": [{"recording": {"id": "filtered-id"}}]}
+        self.oldestdateplugin._recordings_cache["filtered-id"] = RecordingRecord.from_mb(recording)
+        self.oldestdateplugin.config['approach'] = "recordings"
+        with patch.object(self.oldestdateplugin, '_get_work', return_value=WorkRecord.from_mb(work)) as mock_get_work:
+            self.assertIsNone(self.oldestdateplugin._get_oldest_date("filtered-id", None))
+            self.oldestdateplugin.config['release_types'] = ["Official"]
+            self.oldestdateplugin._recordings_cache["filtered-id"] = RecordingRecord.from_mb(recording)
+            self.assertIsNone(self.oldestdateplugin._get_oldest_date("filtered-id", None))
+            self.assertEqual(2, mock_get_work.call_count)
+        self.oldestdateplugin.config['approach'] = "releases"
+        self.oldestdateplugin.config['release_types'] = None
+
+    # Test run statistics
+
+    def test_log_statistics_reports_connection_reuse(self):
+        transport = oldestdate.JsonTransport("test/1.0")
+        transport.pool.opened, transport.pool.reused = 2, 8
+        with patch.object(self.oldestdateplugin, '_json_transport', transport), \
+                patch.object(self.oldestdateplugin, '_total_requests', 10), \
+                patch.object(self.oldestdateplugin._log, 'info') as mock_log:
+            self.oldestdateplugin._log_statistics()
+        mock_log.assert_called_once_with(
+            '10 MusicBrainz requests, 2 connections opened, 8 requests on reused connections')
+
 
 if __name__ == '__main__':
     unittest.main()